@@ -0,0 +1,141 @@
+"""
+AI benchmark: ask_ai_all against a local OpenAI-compatible stand-in server, no network and no api key needed
+
+python scripts/bench_ai.py [--ngranule 15] [--latency 1.0] [--batch_size 5]
+
+The stand-in answers /v1/chat/completions after latency seconds, with token usage, and a json
+object for the batch prompts (create_ai_batch_input). ask_ai_all is timed for:
+- serial: nworkers=1, no rate limit (as before the thread pool)
+- defaults: AI_NWORKERS workers, AI_RATE (no rate limit)
+- rate limited: the defaults at 2 requests per second, as with --ai_rate 2
+- 8 workers, no rate limit
+- batches of batch_size granules (ask_ai_all batch_size)
+- cached: the defaults again with an AI cache filled by a first run, no request expected
+and the messages of each run are checked against the serial run (same granules, same order).
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root)
+
+from tools.orca_ai import ask_ai_all, AI_NWORKERS, AI_RATE
+
+STATE = {"latency": 1.0, "calls": 0, "active": 0, "max_active": 0}
+LOCK = threading.Lock()
+
+def answer(request):
+    """text of the stand-in: the granules of a batch prompt as json, otherwise a fixed text per prompt"""
+    prompt = request["messages"][-1]["content"]
+    timestamps = re.findall(r"^- (\d{8}T\d{6}):", prompt, re.M)
+    if timestamps:
+        return json.dumps({timestamp1: {"short": f"short summary of {timestamp1}", \
+                                        "long": f"long summary of {timestamp1}"} for timestamp1 in timestamps})
+    return f"summary of {len(prompt)} characters: " + " ".join(prompt.split()[:12])
+
+class StandIn(BaseHTTPRequestHandler):
+    """POST /v1/chat/completions of the OpenAI API, with latency"""
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with LOCK:
+            STATE["calls"] += 1
+            STATE["active"] += 1
+            STATE["max_active"] = max(STATE["max_active"], STATE["active"])
+        try:
+            time.sleep(STATE["latency"])
+        finally:
+            with LOCK:
+                STATE["active"] -= 1
+        text = answer(request)
+        prompt_tokens = sum(len(message["content"]) for message in request["messages"])//4
+        body = json.dumps({"id": "standin", "object": "chat.completion", "created": int(time.time()), \
+                           "model": request["model"], \
+                           "choices": [{"index": 0, "finish_reason": "stop", \
+                                        "message": {"role": "assistant", "content": text}}], \
+                           "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(text)//4, \
+                                     "total_tokens": prompt_tokens + len(text)//4}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_standin():
+    """serve the stand-in in a thread, returns the server and its base_url"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def make_infov(ngranule):
+    """info of ngranule granules, as make_plot fills it for ask_ai_all"""
+    infov_dict = {}
+    for i in range(ngranule):
+        timestamp1 = f"20250101T{i//6:02d}{i%6*10:02d}00"
+        infov_dict[timestamp1] = {"timestamp": timestamp1, "center": [10.0+i, -30.0+2*i], \
+                                  "aot": [0.3+0.05*i, 0.1], "ssa": [0.9, 0.05], "fvf": [0.5, 0.2], "sph": [0.6, 0.2]}
+    return infov_dict
+
+def run(infov_dict, base_url, **kwargs):
+    """ask_ai_all, returns the messages, time, requests and requests at once"""
+    with LOCK:
+        STATE.update(calls=0, max_active=0)
+    t0 = time.perf_counter()
+    messages = ask_ai_all(infov_dict, "standin", base_url, **kwargs)
+    return messages, time.perf_counter() - t0, STATE["calls"], STATE["max_active"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ask_ai_all against a local OpenAI-compatible stand-in.")
+    parser.add_argument("--ngranule", type=int, default=15, help="number of granules, two requests each")
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds of each answer")
+    parser.add_argument("--batch_size", type=int, default=5, help="granules per request of the batch run")
+    args = parser.parse_args()
+
+    STATE["latency"] = args.latency
+    server, base_url = start_standin()
+    infov_dict = make_infov(args.ngranule)
+    cache_path = tempfile.mkdtemp(prefix="orca_bench_ai_")
+
+    runs = [("serial", dict(nworkers=1, rate=None)), \
+            (f"defaults ({AI_NWORKERS} workers, {AI_RATE or 'no'} rate limit)", dict()), \
+            ("rate limited (2/s)", dict(rate=2.0)), \
+            ("8 workers, no rate limit", dict(nworkers=8, rate=None)), \
+            (f"batches of {args.batch_size}", dict(batch_size=args.batch_size)), \
+            ("cache filled", dict(cache_path=cache_path)), \
+            ("cached", dict(cache_path=cache_path))]
+    results, failed, reference = [], [], None
+    for name, kwargs in runs:
+        messages, seconds, calls, max_active = run(infov_dict, base_url, **kwargs)
+        results.append((name, seconds, calls, max_active))
+        reference = reference or messages
+        #same granules in the same order, the batch answers differ from the one by one answers
+        same = all(list(messagev) == list(infov_dict) and all(messagev.values()) for messagev in messages) \
+               and (messages == reference or kwargs.get("batch_size", 1) > 1)
+        if not same:
+            failed.append(name)
+    if results[-1][2] != 0:
+        failed.append("cached (requests sent)")
+    #the shipped defaults must beat the serial requests
+    if results[1][1] >= results[0][1]:
+        failed.append("defaults (not faster than serial)")
+
+    server.shutdown()
+    shutil.rmtree(cache_path, ignore_errors=True)
+    print(f"\n{args.ngranule} granules, {args.latency} s per answer")
+    for name, seconds, calls, max_active in results:
+        print(f"{name:36s} {seconds:6.2f} s  {calls:3d} requests, {max_active} at once")
+    if failed:
+        print(f"❌ Failed: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"✅ same messages, in the order of the granules, defaults {results[0][1]/results[1][1]:.1f}x faster than serial")
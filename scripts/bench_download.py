@@ -0,0 +1,254 @@
+"""
+Download benchmark: download_l2_web against a local stand-in of oceandata (file_search + getfile),
+no network and no appkey needed
+
+python scripts/bench_download.py [--nfile 8] [--size_mb 4] [--nworkers 6] [--rate_mb 20]
+
+The stand-in serves small netCDF granules, throttled to rate_mb MB/s per connection, with
+HTTP Range/If-Range support (ETag, Last-Modified). The checks, each printed with the bytes served and the time:
+- concurrency: nworkers=1 then nworkers, with the number of transfers running at once
+- skip-valid: a second run over the same folder transfers nothing
+- resume: every first transfer is dropped after a third of the file, the retry resumes
+  from the .part file with a Range request instead of starting over, and the files match the served ones
+- reprocessed: the files change on the server after the drop (e.g. NRT reprocessing), the retry
+  gets the new files whole (If-Range) instead of splicing them onto the old bytes
+- gzip: the server gzips the files even when asked for identity, the files are still the served ones
+- complete part: .part files already complete (the server answers 416 to their Range), renamed
+  without downloading them again
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import hashlib
+import shutil
+import argparse
+import tempfile
+import threading
+import numpy as np
+import netCDF4 as nc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root)
+
+from tools import orca_download
+from tools.orca_download import download_l2_web, RetryPolicy
+
+FILES = {}  #file name: bytes served by getfile
+STATE = {"rate": 20e6, "drop_fraction": None, "dropped": set(), "on_drop": None, "gzip": False, \
+         "gets": 0, "ranges": 0, "bytes": 0, "active": 0, "max_active": 0}
+LOCK = threading.Lock()
+
+def make_granules(folder, nfile=8, size=4_000_000):
+    """nfile netCDF4 granules of about size bytes, named as the HARP2 L2 NRT files"""
+    for i in range(nfile):
+        file_name = f"PACE_HARP2.20250101T{i:02d}0000.L2.MAPOL_OCEAN.V3.0.NRT.nc"
+        file1 = os.path.join(folder, file_name)
+        with nc.Dataset(file1, "w") as ds:
+            ds.createDimension("n", size)
+            ds.createVariable("data", "u1", ("n",))[:] = np.random.randint(0, 255, size, dtype=np.uint8)
+        with open(file1, "rb") as f:
+            FILES[file_name] = f.read()
+
+class StandIn(BaseHTTPRequestHandler):
+    """POST /api/file_search: the list of FILES, GET/HEAD /cgi/getfile/<name>: the file, with Range/If-Range"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = ("\n".join(FILES) + "\n").encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        file_name = self.path.rsplit("/", 1)[-1]
+        if file_name not in FILES:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body, start = FILES[file_name], 0
+        etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        range1 = self.headers.get("Range")
+        #Range only applies to the same version of the file
+        if range1 and self.headers.get("If-Range", etag) != etag:
+            range1 = None
+        if STATE["gzip"]:
+            body, range1 = gzip.compress(body, compresslevel=1), None
+        if range1:
+            start = int(range1.split("=")[1].split("-")[0])
+        if range1 and start >= len(body):
+            with LOCK:
+                STATE["gets"] += 1
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(body)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if range1:
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(body)-1}/{len(body)}")
+        else:
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        if STATE["gzip"]:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)-start))
+        self.end_headers()
+        if head:
+            return
+
+        #the first transfer of each file is dropped after drop_fraction of it
+        end = len(body)
+        with LOCK:
+            STATE["gets"] += 1
+            STATE["ranges"] += bool(range1)
+            if STATE["drop_fraction"] and file_name not in STATE["dropped"]:
+                STATE["dropped"].add(file_name)
+                end = start + int((len(body)-start)*STATE["drop_fraction"])
+            STATE["active"] += 1
+            STATE["max_active"] = max(STATE["max_active"], STATE["active"])
+        try:
+            chunk = 256*1024
+            for i in range(start, end, chunk):
+                t0 = time.perf_counter()
+                self.wfile.write(body[i:min(i+chunk, end)])
+                with LOCK:
+                    STATE["bytes"] += min(i+chunk, end) - i
+                time.sleep(max(0, (min(i+chunk, end) - i)/STATE["rate"] - (time.perf_counter()-t0)))
+        finally:
+            with LOCK:
+                STATE["active"] -= 1
+        if end < len(body):
+            self.close_connection = True
+            if STATE["on_drop"]:
+                STATE["on_drop"](file_name)
+
+def start_standin():
+    """serve the stand-in in a thread, point orca_download to it"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    orca_download.OB_DAAC_API = url + "/api/file_search"
+    orca_download.OB_DAAC_GETFILE = url + "/cgi/getfile/"
+    return server
+
+def run(output_folder, nworkers, policy):
+    """download_l2_web into output_folder, returns the files, bytes served and time"""
+    with LOCK:
+        STATE.update(gets=0, ranges=0, bytes=0, max_active=0)
+    t0 = time.perf_counter()
+    files = download_l2_web(("2025-01-01 00:00:00", "2025-01-01 23:59:59"), "appkey", \
+                            output_folder=output_folder, filelist_name=os.path.join(output_folder, "filelist.txt"), \
+                            nworkers=nworkers, policy=policy)
+    return files, STATE["bytes"], time.perf_counter() - t0
+
+def reprocess(file_name):
+    """new version of a granule on the server: same size, other data in the part already downloaded"""
+    body, i = FILES[file_name], len(FILES[file_name])//6
+    FILES[file_name] = body[:i] + os.urandom(1000) + body[i+1000:]
+
+def same_files(output_folder):
+    """the downloaded files are the served ones"""
+    for file_name, body in FILES.items():
+        with open(os.path.join(output_folder, file_name), "rb") as f:
+            if f.read() != body:
+                return False
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark download_l2_web against a local oceandata stand-in.")
+    parser.add_argument("--nfile", type=int, default=8, help="number of granules")
+    parser.add_argument("--size_mb", type=float, default=4, help="size of each granule (MB)")
+    parser.add_argument("--nworkers", type=int, default=6, help="concurrent downloads of the second run")
+    parser.add_argument("--rate_mb", type=float, default=20, help="bandwidth of each connection (MB/s)")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="orca_bench_download_")
+    make_granules(work, nfile=args.nfile, size=int(args.size_mb*1e6))
+    STATE["rate"] = args.rate_mb*1e6
+    total = sum(len(body) for body in FILES.values())
+    server = start_standin()
+    policy = RetryPolicy(base_delay=0.1, max_delay=1)
+    output_folder = os.path.join(work, "l2")
+    failed = []
+
+    #concurrency
+    seconds = {}
+    for nworkers in [1, args.nworkers]:
+        shutil.rmtree(output_folder, ignore_errors=True)
+        files, nbytes, seconds[nworkers] = run(output_folder, nworkers, policy)
+        print(f"nworkers={nworkers}: {len(files)} files, {nbytes/1e6:.1f} MB in {seconds[nworkers]:.2f} s, "
+              f"{STATE['max_active']} transfers at once")
+        if len(files) != len(FILES) or nbytes != total or not same_files(output_folder):
+            failed.append(f"concurrency (nworkers={nworkers})")
+    print(f"speedup with nworkers={args.nworkers}: {seconds[1]/seconds[args.nworkers]:.1f}x")
+
+    #skip-valid
+    files, nbytes, dt = run(output_folder, args.nworkers, policy)
+    print(f"skip-valid: {len(files)} files, {STATE['gets']} GET, {nbytes/1e6:.1f} MB in {dt:.2f} s")
+    if files or STATE["gets"]:
+        failed.append("skip-valid")
+
+    #resume after a dropped connection
+    shutil.rmtree(output_folder, ignore_errors=True)
+    STATE["drop_fraction"] = 1/3
+    files, nbytes, dt = run(output_folder, args.nworkers, policy)
+    print(f"resume: {len(files)} files, {STATE['gets']} GET ({STATE['ranges']} Range), "
+          f"{nbytes/1e6:.1f} MB for {total/1e6:.1f} MB of files in {dt:.2f} s")
+    #restarting from zero would serve total*(1+drop_fraction), the bytes read before the drop are kept
+    #(but for the last chunk being read when the connection closed)
+    if len(files) != len(FILES) or STATE["ranges"] != len(FILES) or nbytes >= total*(1+STATE["drop_fraction"]) \
+       or not same_files(output_folder):
+        failed.append("resume")
+
+    #reprocessed on the server after the drop
+    shutil.rmtree(output_folder, ignore_errors=True)
+    STATE.update(dropped=set(), on_drop=reprocess)
+    files, nbytes, dt = run(output_folder, args.nworkers, policy)
+    print(f"reprocessed: {len(files)} files, {STATE['gets']} GET ({STATE['ranges']} Range), "
+          f"{nbytes/1e6:.1f} MB for {total/1e6:.1f} MB of files in {dt:.2f} s")
+    if len(files) != len(FILES) or not same_files(output_folder):
+        failed.append("reprocessed")
+    STATE.update(drop_fraction=None, on_drop=None)
+
+    #content encoding forced by the server
+    shutil.rmtree(output_folder, ignore_errors=True)
+    STATE["gzip"] = True
+    files, nbytes, dt = run(output_folder, args.nworkers, policy)
+    print(f"gzip: {len(files)} files, {nbytes/1e6:.1f} MB served for {total/1e6:.1f} MB of files in {dt:.2f} s")
+    if len(files) != len(FILES) or not same_files(output_folder):
+        failed.append("gzip")
+    STATE["gzip"] = False
+
+    #.part files complete, left by a run stopped before renaming them
+    shutil.rmtree(output_folder, ignore_errors=True)
+    os.makedirs(output_folder)
+    for file_name, body in FILES.items():
+        with open(os.path.join(output_folder, file_name+".part"), "wb") as f:
+            f.write(body)
+        with open(os.path.join(output_folder, file_name+".part.json"), "w") as f:
+            json.dump({"url": orca_download.OB_DAAC_GETFILE+file_name, \
+                       "validator": '"' + hashlib.sha1(body).hexdigest()[:16] + '"'}, f)
+    files, nbytes, dt = run(output_folder, args.nworkers, policy)
+    print(f"complete part: {len(files)} files, {STATE['gets']} GET, {nbytes/1e6:.1f} MB in {dt:.2f} s")
+    if len(files) != len(FILES) or nbytes or not same_files(output_folder):
+        failed.append("complete part")
+
+    server.shutdown()
+    shutil.rmtree(work, ignore_errors=True)
+    if failed:
+        print(f"❌ Failed: {', '.join(failed)}")
+        sys.exit(1)
+    print("✅ concurrency, skip-valid, resume, reprocessed, gzip and complete part checked")
@@ -0,0 +1,51 @@
+"""
+Startup benchmark: time to import the entry points of the toolkit in a fresh python,
+and which heavy packages each of them loads
+
+python scripts/bench_startup.py [--repeat 5]
+
+tools.orca_detect (headless selection/statistics) should stay well under a second and
+load none of matplotlib, cartopy, openai, earthaccess, xarray.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+MODULES = ["tools.orca_data", "tools.orca_index", "tools.orca_stats", "tools.orca_detect", \
+           "tools.orca_download", "tools.orca_plot", "tools.orca_ai", "tools.orca_html"]
+HEAVY = ["matplotlib", "cartopy", "openai", "earthaccess", "xarray", "netCDF4", "PIL", "pandas", "requests"]
+
+#imports the module and prints the heavy packages it loaded
+CHECK = "import sys, json, {module}; print(json.dumps([m for m in {heavy} if m in sys.modules]))"
+
+def time_import(module, repeat=5, cwd="."):
+    """best wall time (s) of python -c 'import module' over repeat runs, and the heavy packages loaded"""
+    best, loaded = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", CHECK.format(module=module, heavy=HEAVY)], \
+                                cwd=cwd, capture_output=True, text=True)
+        best = min(best, time.perf_counter()-t0)
+        if result.returncode != 0:
+            print(f"❌ import {module} failed: {result.stderr.strip().splitlines()[-1]}")
+            return None, None
+        loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return best, loaded
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the import time of the toolkit modules.")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per module, the best one is kept")
+    parser.add_argument("--modules", type=str, nargs="+", default=MODULES, help="modules to import")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    baseline, _ = time_import("os", repeat=args.repeat, cwd=root)
+    print(f"python startup: {baseline:.2f} s")
+    for module in args.modules:
+        seconds, loaded = time_import(module, repeat=args.repeat, cwd=root)
+        if seconds is not None:
+            print(f"{module:22s} {seconds:6.2f} s  loads: {', '.join(loaded) or '-'}")
@@ -0,0 +1,80 @@
+"""
+Render profile check: the html step of orca_run.py with render_profiles=("preview", "full"),
+as with --full_resolution, on small figures saved in a temporary plot folder
+
+python scripts/check_render_profiles.py
+
+The plots of each granule and the global map are saved with save_figure/plot_bounding_box_many,
+the full resolution copies going to the full/ subfolders. The page must have one section per
+granule (no 'full' section), embed the preview jpg files only, and the full resolution pngs must exist.
+"""
+
+import os
+import re
+import sys
+import shutil
+import tempfile
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root)
+
+from tools.orca_plot import RENDER_PROFILES, save_figure, render_fileouts, plot_bounding_box_many
+from tools.orca_html import get_images_from_subfolders, create_html_from_subfolders
+
+RENDER = ("preview", "full")
+TIMESTAMPS = ["20250101T100000", "20250101T120000"]
+
+def make_plots(plot_path):
+    """one small map per granule, the info of plot_l1c_l2 and the global map, returns the infov and global map"""
+    infov = []
+    for i, timestamp1 in enumerate(TIMESTAMPS):
+        fig = plt.figure(figsize=(3, 2))
+        plt.imshow([[0, i], [i, 1]])
+        save_figure(fig, os.path.join(plot_path, timestamp1, timestamp1+"_aot.png"), dpi=100, render_profiles=RENDER)
+        plt.close(fig)
+        lat, lon = 10.0*i, -30.0+20*i
+        infov.append({"timestamp": timestamp1, "center": [lat, lon], \
+                      "boundingbox": [[lat-5, lat-5, lat+5, lat+5, lat-5], [lon-5, lon+5, lon+5, lon-5, lon-5]]})
+    global_map1 = os.path.join(plot_path, "PACE_HARP2_L2_2025-01-01_boxes.png")
+    plot_bounding_box_many(infov, title="2025-01-01", fileout=global_map1, render_profiles=RENDER)
+    return infov, global_map1
+
+if __name__ == "__main__":
+    work = tempfile.mkdtemp(prefix="orca_check_render_")
+    plot_path = os.path.join(work, "plot")
+    infov, global_map1 = make_plots(plot_path)
+
+    #as in orca_run.py
+    fileouts = render_fileouts(global_map1, RENDER)
+    image_groups = get_images_from_subfolders(plot_path, exclude=RENDER_PROFILES)
+    output_file = os.path.join(work, "page.html")
+    create_html_from_subfolders(image_groups, output_file, [["aot"]], global_map=fileouts[0][1], \
+                                titlev=[["AOD (550nm)"]], resolution_factor=1, quality=75, \
+                                message1v={info["timestamp"]: "long" for info in infov}, \
+                                message2v={info["timestamp"]: "short" for info in infov}, \
+                                infov_dict={info["timestamp"]: info for info in infov})
+    with open(output_file) as f:
+        html = f.read()
+
+    failed = []
+    sections = re.findall(r"<h2 id='([^']+)'", html)
+    print(f"sections: {', '.join(sections)}")
+    if sections != TIMESTAMPS:
+        failed.append("sections")
+    embedded = set(re.findall(r"data:image/(\w+);base64", html))
+    print(f"embedded images: {', '.join(sorted(embedded))}")
+    if embedded != {"jpeg"}:
+        failed.append("preview only")
+    exports = [file1 for _, file1 in fileouts[1:]] + \
+              [render_fileouts(os.path.join(plot_path, t, t+"_aot.png"), RENDER)[1][1] for t in TIMESTAMPS]
+    if not all(os.path.isfile(file1) for file1 in exports):
+        failed.append("full resolution files")
+
+    shutil.rmtree(work, ignore_errors=True)
+    if failed:
+        print(f"❌ Failed: {', '.join(failed)}")
+        sys.exit(1)
+    print("✅ one section per granule, previews embedded, full resolution files kept")
@@ -3,10 +3,217 @@ Get AI (chat-gpt-5) to explain the aerosol event
 need apply for api with NAMS.
 
 Meng Gao, Sep 30, 2025
+
+The calls of ask_ai_all run on a thread pool, both prompts of a granule at once, with one
+openai client per (api_key, base_url) shared by all threads and a rate limiter on the requests.
+base_url can be any OpenAI-compatible server.
+
+With cache_path, the responses are kept on disk (tools/orca_cache.py, ai_cache_get/ai_cache_put),
+keyed by the model and the prompts: the same granule asked again (e.g. a spotlight re-run) is
+answered from the cache, without a request.
+
+With batch_size>1, ask_ai_all puts the aerosol values of batch_size granules in one request and asks
+for a json object {timestamp: {"short": message2, "long": message1}} (AI_SYSTEM_BATCH, json response
+format); granules missing from a valid answer are asked one by one as before.
+
+AIUsage records the tokens, time and errors of every request, and holds the token/time budget of
+the run: when it runs low, the structured summaries (message1) are dropped before the short ones.
 """
-import openai
+import os
+import re
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
+from tools.orca_cache import ai_cache_get, ai_cache_put, evict_ai_cache
+
+AI_NWORKERS = 4  #concurrent requests
+AI_RATE = None  #requests per second, None: no limit (the AI_NWORKERS requests in flight are the only cap),
+                 #set it (--ai_rate) to the quota of the endpoint if it throttles
+AI_LOW_FRACTION = 0.2  #budget left below which only the short summaries are requested
+AI_TOKENS_ESTIMATE = 2000  #tokens reserved for a request in flight, until requests of its kind have been answered
+
+#system prompt of the structured summary (message1)
+AI_SYSTEM_STRUCTURE = """You are an atmospheric scientist. Always respond with a clear structured summary:
+             1. **Location**: state coordinates and region.
+             2. **Aerosol Type**: describe the likely dominant aerosol. State the values in the format of (AOD x±x, SSA x±x, FVF x±x, sph x±x).
+             3. **Sources & Transport**: identify possible sources and transport pathways.
+             4. **Climate & Environment Impact**: note potential effects briefly.
+             5. **Earth Science Grand Questions and Challenges**: propose potential earth science question and challenges regarding this aerosol event.
+             Keep the format consistent every time. 
+             For long message, if several points are given, specify them into different lines start with -."""
+
+#system prompt of the batch requests (create_ai_batch_input), the same points inside a json object
+AI_SYSTEM_BATCH = """You are an atmospheric scientist. Respond only with a JSON object, no text or markdown around it.
+             Each "long" value is a structured summary with one line per point, each line starting with -:
+             Location (coordinates and region); Aerosol Type (likely dominant aerosol, with the values in the format of
+             (AOD x±x, SSA x±x, FVF x±x, sph x±x)); Sources & Transport; Climate & Environment Impact;
+             Earth Science Grand Questions and Challenges.
+             Keep the format consistent for every timestamp."""
+
+class RateLimiter:
+    """
+    Token bucket shared by the threads: at most burst requests at once, then rate per second.
+    rate None: no limit
+    """
+    def __init__(self, rate=AI_RATE, burst=AI_NWORKERS):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.t_last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """wait until a request can start"""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.t_last)*self.rate)
+                self.t_last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens)/self.rate
+            time.sleep(wait)
+
+class AIUsage:
+    """
+    Token and time accounting of the AI requests of a run, with an optional budget.
+
+    Parameters:
+    ----------
+    max_tokens : int or None
+        Prompt+completion tokens the run may spend.
+    max_seconds : float or None
+        Time the run may spend on AI requests, counted from the creation of AIUsage.
+    low_fraction : float
+        Below this fraction of either budget left, only the short summaries are requested (reserve("short")).
+
+    The tokens of the requests in flight are reserved when they start (reserve/release), so the nworkers
+    requests running at once do not all overshoot the token budget. The reservation is an estimate
+    (estimate()), so the budget can still be exceeded by the difference. Requests in flight when the
+    time budget runs out are not interrupted.
+
+    Every request is recorded in self.calls (name, cached, prompt_tokens, completion_tokens, seconds, error),
+    summarized by summary() and saved by report().
+    """
+    def __init__(self, max_tokens=None, max_seconds=None, low_fraction=AI_LOW_FRACTION):
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.low_fraction = low_fraction
+        self.t_start = time.monotonic()
+        self.time_start = time.time()
+        self.calls = []
+        self.dropped = {"long": 0, "short": 0}
+        self.reserved = 0  #tokens of the requests in flight
+        self._lock = threading.RLock()
+        self._released = threading.Condition(self._lock)
+
+    def record(self, name, cached=False, prompt_tokens=0, completion_tokens=0, seconds=0.0, error=None):
+        with self._lock:
+            self.calls.append({"name": name, "cached": cached, "prompt_tokens": prompt_tokens, \
+                               "completion_tokens": completion_tokens, "seconds": seconds, \
+                               "error": None if error is None else type(error).__name__})
+
+    def tokens(self):
+        with self._lock:
+            return sum(call["prompt_tokens"] + call["completion_tokens"] for call in self.calls)
+
+    def estimate(self, name=None):
+        """tokens expected for a request of name: the mean of its answered requests, AI_TOKENS_ESTIMATE before"""
+        with self._lock:
+            tokensv = [call["prompt_tokens"] + call["completion_tokens"] for call in self.calls \
+                       if call["name"] == name and not call["cached"] and call["error"] is None]
+        return sum(tokensv)//len(tokensv) if tokensv else AI_TOKENS_ESTIMATE
+
+    def left(self, extra_tokens=0):
+        """fraction of the budget left, the smaller of tokens (with those reserved) and time (1 without budget)"""
+        left = 1.0
+        if self.max_tokens:
+            with self._lock:
+                left = min(left, 1 - (self.tokens() + self.reserved + extra_tokens)/self.max_tokens)
+        if self.max_seconds:
+            left = min(left, 1 - (time.monotonic() - self.t_start)/self.max_seconds)
+        return left
+
+    def reserve(self, kind, name=None):
+        """
+        whether a request of kind ("long": structured summary or batch, "short") and name may start,
+        counting the tokens of the requests in flight and its own estimate; if they do not fit,
+        it waits for the requests in flight to end, then decides on the tokens spent as without reservation.
+        Returns the tokens reserved for it, to release() when it ends, or None if refused
+        (counted in self.dropped)
+        """
+        with self._lock:
+            while True:
+                tokens = self.estimate(name) if self.max_tokens else 0
+                #nothing in flight: the request only needs budget left, as one request at a time
+                left = self.left(extra_tokens=tokens if self.reserved else 0)
+                if left > 0 and (kind == "short" or left > self.low_fraction):
+                    self.reserved += tokens
+                    return tokens
+                if self.reserved == 0:
+                    self.dropped[kind] += 1
+                    return None
+                self._released.wait()
+
+    def release(self, tokens):
+        """end of a request started by reserve(), its tokens are then counted by record()"""
+        with self._lock:
+            self.reserved -= tokens
+            self._released.notify_all()
+
+    def summary(self):
+        """Number of requests, cache hits, failures, tokens and time spent, per function name"""
+        summary = {}
+        with self._lock:
+            for call in self.calls:
+                entry = summary.setdefault(call["name"], {"calls": 0, "cached": 0, "failures": 0, "prompt_tokens": 0, \
+                                                          "completion_tokens": 0, "seconds": 0.0, "max_seconds": 0.0})
+                entry["calls"] += 1
+                entry["cached"] += call["cached"]
+                entry["failures"] += call["error"] is not None
+                entry["prompt_tokens"] += call["prompt_tokens"]
+                entry["completion_tokens"] += call["completion_tokens"]
+                entry["seconds"] += call["seconds"]
+                entry["max_seconds"] = max(entry["max_seconds"], call["seconds"])
+        return summary
+
+    def report(self, file_report):
+        """save the budget, summary and all requests of the run to a json file"""
+        os.makedirs(os.path.dirname(file_report) or ".", exist_ok=True)
+        with self._lock:
+            calls, dropped = list(self.calls), dict(self.dropped)
+        errors = {}
+        for call in calls:
+            if call["error"]:
+                errors[call["error"]] = errors.get(call["error"], 0) + 1
+        report = {"start": self.time_start, "seconds": time.monotonic() - self.t_start, \
+                  "budget": {"max_tokens": self.max_tokens, "max_seconds": self.max_seconds, \
+                             "low_fraction": self.low_fraction}, \
+                  "tokens": self.tokens(), "dropped": dropped, "errors": errors, \
+                  "summary": self.summary(), "calls": calls}
+        tmp = f"{file_report}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(report, f, indent=1)
+        os.replace(tmp, file_report)
+        print(f"✅ AI usage report saved to {file_report}")
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(api_key, base_url):
+    """openai client of (api_key, base_url), created once and shared (the client is thread safe)"""
+    with _clients_lock:
+        if (api_key, base_url) not in _clients:
+            import openai
+            _clients[(api_key, base_url)] = openai.OpenAI(api_key=api_key, base_url=base_url)
+        return _clients[(api_key, base_url)]
+
 def add_hemisphere(deg, is_latitude=True):
     """
     Add hemisphere indicators to the coordinate, formatted to two decimal places.
@@ -51,87 +258,264 @@ def create_ai_input(info, words, requirements=None):
     
     return input1
     
-def ask_ai_all(infov_dict, api_key, base_url):
+#responses answered from the cache (hits) or requested (misses), since the start of the run
+ai_cache_counts = {"hits": 0, "misses": 0}
+_counts_lock = threading.Lock()
+
+def chat_completion(api_key, base_url, request, cache_path=None, limiter=None, validate=None, usage=None, name="chat"):
+    """
+    text of the response to request (arguments of client.chat.completions.create),
+    from the cache if the same request was answered before, the limiter only counts actual requests
+
+    validate: function of the text, a response it rejects is neither taken from nor saved to the cache
+    usage: AIUsage recording the request under name
+    """
+    output = ai_cache_get(cache_path, request)
+    if output is not None and validate is not None and not validate(output):
+        output = None
+    with _counts_lock:
+        ai_cache_counts["hits" if output is not None else "misses"] += 1
+    if output is not None:
+        if usage is not None:
+            usage.record(name, cached=True)
+        return output
+
+    if limiter is not None:
+        limiter.acquire()
+    client = get_client(api_key, base_url)
+    t0 = time.monotonic()
+    try:
+        response = client.chat.completions.create(**request)
+    except Exception as e:
+        if usage is not None:
+            usage.record(name, seconds=time.monotonic() - t0, error=e)
+        raise
+    if usage is not None:
+        tokens = getattr(response, "usage", None)
+        usage.record(name, prompt_tokens=getattr(tokens, "prompt_tokens", 0) or 0, \
+                     completion_tokens=getattr(tokens, "completion_tokens", 0) or 0, seconds=time.monotonic() - t0)
+    output = response.choices[0].message.content
+    if validate is None or validate(output):
+        ai_cache_put(cache_path, request, output)
+    return output
+
+def create_ai_batch_input(infov_batch, words_short=30, words_long=150):
+    """
+    one prompt for all granules of infov_batch ({timestamp: info}), asking for a json object
+    {timestamp: {"short": ..., "long": ...}}, the same summaries as the two prompts of ask_ai_all
+    """
+    lines = []
+    for timestamp1, info in infov_batch.items():
+        lat, lon = info['center']
+        lines.append(f"- {timestamp1}: location near lat={add_hemisphere(lat)}, lon={add_hemisphere(lon, False)}, "
+                     f"aod={info['aot'][0]:0.2f}±{info['aot'][1]:0.3f}, ssa={info['ssa'][0]:0.2f}±{info['ssa'][1]:0.3f}, "
+                     f"fvf={info['fvf'][0]:0.2f}±{info['fvf'][1]:0.3f}, sph={info['sph'][0]:0.2f}±{info['sph'][1]:0.3f}")
+
+    input1 = ("Aerosol retrievals of several scenes, given by timestamp, with aerosol optical depth (aod), "
+              "single scattering albedo (ssa), fine mode volume fraction (fvf) and spherical fraction (sph). "
+              "Consider the uncertainties (±) in these data.\n"
+              + "\n".join(lines) +
+              "\nRespond only with a JSON object with one key per timestamp, each value an object with two strings: "
+              "\"short\": summarize the aerosol event in terms of aerosol type, possible source and transport in two sentences, "
+              f"as specific as possible, within {words_short} words; "
+              f"\"long\": the structured summary, within {words_long} words, one line per point (use \\n).")
+    return input1
+
+def parse_ai_batch(output, timestamps):
+    """
+    {timestamp: (message1, message2)} of the answer of create_ai_batch_input,
+    only the timestamps of the batch with non-empty "short" and "long" texts
+    """
+    #the json object, also when wrapped in ```json ... ``` or text
+    match = re.search(r"\{.*\}", output or "", re.S)
+    try:
+        answer = json.loads(match.group(0)) if match else {}
+    except ValueError:
+        return {}
+    messages = {}
+    for timestamp1 in timestamps:
+        entry = answer.get(timestamp1) if isinstance(answer, dict) else None
+        if isinstance(entry, dict) and all(isinstance(entry.get(key), str) and entry[key].strip() \
+                                           for key in ["short", "long"]):
+            messages[timestamp1] = (entry["long"], entry["short"])
+    return messages
+
+def call_ai_api_batch(api_key, base_url, infov_batch, max_tokens=None, cache_path=None, limiter=None, usage=None):
+    """
+    both summaries of all granules of infov_batch in one request,
+    returns {timestamp: (message1, message2)} of the granules answered
+    """
+    timestamps = list(infov_batch)
+    request = dict(
+        model="gpt-5",
+        messages=[
+            {"role": "system", "content": AI_SYSTEM_BATCH},
+            {"role": "user", "content": create_ai_batch_input(infov_batch)}
+        ],
+        response_format={"type": "json_object"},
+        max_tokens=max_tokens
+    )
+    #an answer without any valid granule is not kept in the cache
+    output = chat_completion(api_key, base_url, request, cache_path=cache_path, limiter=limiter, \
+                             validate=lambda output: len(parse_ai_batch(output, timestamps)) > 0, \
+                             usage=usage, name="call_ai_api_batch")
+    return parse_ai_batch(output, timestamps)
+
+def ask_ai(func, api_key, base_url, input1, limiter=None, cache_path=None, usage=None, kind="short"):
+    """
+    one request of ask_ai_all, 'over budget' if the budget of usage does not allow a request of kind,
+    the error class if it fails
+    """
+    reserved = usage.reserve(kind, func.__name__) if usage is not None else 0
+    if reserved is None:
+        return 'over budget'
+    try:
+        return func(api_key, base_url, input1, cache_path=cache_path, limiter=limiter, usage=usage)
+    except Exception as e:
+        print(f"❌ {func.__name__} failed: {type(e).__name__}: {e}")
+        return f'AI request failed ({type(e).__name__})'
+    finally:
+        if usage is not None:
+            usage.release(reserved)
+
+def ai_message_failed(message):
+    """no answer to the request: missing, 'over budget' or 'AI request failed (...)', see ask_ai"""
+    return not isinstance(message, str) or message == 'over budget' or message.startswith('AI request failed')
+
+def ask_ai_batch(api_key, base_url, infov_batch, limiter=None, cache_path=None, usage=None):
+    """call_ai_api_batch, if the budget allows the long summaries, nothing is answered otherwise"""
+    reserved = usage.reserve("long", "call_ai_api_batch") if usage is not None else 0
+    if reserved is None:
+        return {}
+    try:
+        return call_ai_api_batch(api_key, base_url, infov_batch, cache_path=cache_path, limiter=limiter, usage=usage)
+    finally:
+        if usage is not None:
+            usage.release(reserved)
+
+def ask_ai_batches(executor, infov_dict, api_key, base_url, batch_size, limiter=None, cache_path=None, usage=None):
+    """
+    call_ai_api_batch on batches of batch_size granules,
+    returns {timestamp: (message1, message2)} of the granules answered
+    """
+    infov_valid = {}
+    for timestamp1, info in infov_dict.items():
+        try:
+            create_ai_batch_input({timestamp1: info})
+            infov_valid[timestamp1] = info
+        except Exception as e:
+            print(f"❌ No AI input for {timestamp1}: {e}")
+    timestamps = list(infov_valid)
+    futures = {executor.submit(ask_ai_batch, api_key, base_url, \
+                               {timestamp1: infov_valid[timestamp1] for timestamp1 in timestamps[i:i+batch_size]}, \
+                               limiter=limiter, cache_path=cache_path, usage=usage): timestamps[i:i+batch_size] \
+               for i in range(0, len(timestamps), batch_size)}
+
+    messages = {}
+    for future in tqdm(as_completed(futures), total=len(futures)):
+        try:
+            messages.update(future.result())
+        except Exception as e:
+            print(f"❌ call_ai_api_batch failed for {futures[future]}: {e}")
+    return messages
+
+def ask_ai_all(infov_dict, api_key, base_url, nworkers=AI_NWORKERS, rate=AI_RATE, cache_path=None, batch_size=1, \
+               usage=None):
     """
     infov_dict is a dictionary with timestamp as key
+
+    the structured (message1) and short (message2) summaries of all granules are requested
+    concurrently by nworkers threads, at most rate requests per second (None: no limit)
+    cache_path: AI response cache, see tools/orca_cache.py, disabled if None
+    batch_size: if >1, granules are asked batch_size at a time with both summaries in one json answer
+                (call_ai_api_batch), the granules not answered are then asked one by one
+    usage: AIUsage with the budget of the run, its records can be saved with usage.report(file);
+           the short summaries are requested first, and only those once the budget runs low
     """
     message1v={}
     message2v={}
-    #for info in tqdm(infov):
-    #for info in tqdm(infov_dict.values()):
-    for timestamp1 in tqdm(infov_dict.keys()):
-        info = infov_dict[timestamp1]
-        try:
-            requirements = "Explain the aerosol type, event, sources, transport and impacts."
-            input1 = create_ai_input(info, 150, requirements)
-            print(input1)
-            message1 = call_ai_api_structure(api_key, base_url, input1)
-        except:
-            message1 = 'over budget'
-
-        #try:
-        #    input2 = create_ai_input(info, 70)
-        #    print(input2)
-        #    message2 = call_ai_api_structure(api_key, base_url, input2)
-        #except:
-        #    message2 = 'over budget'
+    usage = usage or AIUsage()
+    counts0 = dict(ai_cache_counts)
+    limiter = RateLimiter(rate, burst=nworkers)
+    with ThreadPoolExecutor(max_workers=max(nworkers, 1)) as executor:
+        if batch_size > 1:
+            for timestamp1, (message1, message2) in ask_ai_batches(executor, infov_dict, api_key, base_url, batch_size, \
+                                                                  limiter=limiter, cache_path=cache_path, \
+                                                                  usage=usage).items():
+                message1v[timestamp1], message2v[timestamp1] = message1, message2
+            if len(message1v) < len(infov_dict):
+                print(f"⚠️ {len(infov_dict)-len(message1v)} granules not answered by the batches, asked one by one")
 
-        try:
-            #shorrt summary
-            requirements = "Summarize the aerosol event in terms of aerosol type, possible source and transport in two sentence. Make the information as specific as possible."
-            input2 = create_ai_input(info, 30, requirements)
-            print(input2)
-            message2 = call_ai_api_simple(api_key, base_url, input2)
-        except:
-            message2 = 'over budget'
-            
-        message1v[timestamp1]=message1
-        message2v[timestamp1]=message2
-        
+        inputs = {}
+        for timestamp1, info in infov_dict.items():
+            if timestamp1 in message1v:
+                continue
+            try:
+                requirements = "Explain the aerosol type, event, sources, transport and impacts."
+                input1 = create_ai_input(info, 150, requirements)
+                print(input1)
+
+                #shorrt summary
+                requirements = "Summarize the aerosol event in terms of aerosol type, possible source and transport in two sentence. Make the information as specific as possible."
+                input2 = create_ai_input(info, 30, requirements)
+                print(input2)
+            except Exception as e:
+                print(f"❌ No AI input for {timestamp1}: {e}")
+                message1v[timestamp1] = message2v[timestamp1] = f'AI request failed ({type(e).__name__})'
+                continue
+            inputs[timestamp1] = (input1, input2)
+
+        #all short summaries are queued before the structured ones, which are dropped first when the budget runs low
+        futures = {}
+        for timestamp1, (input1, input2) in inputs.items():
+            futures[executor.submit(ask_ai, call_ai_api_simple, api_key, base_url, input2, limiter, cache_path, \
+                                    usage, "short")] = (message2v, timestamp1)
+        for timestamp1, (input1, input2) in inputs.items():
+            futures[executor.submit(ask_ai, call_ai_api_structure, api_key, base_url, input1, limiter, cache_path, \
+                                    usage, "long")] = (message1v, timestamp1)
+
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            messagev, timestamp1 = futures[future]
+            messagev[timestamp1] = future.result()
+
+    if cache_path:
+        hits, misses = [ai_cache_counts[key]-counts0[key] for key in ["hits", "misses"]]
+        print(f"✅ AI cache: {hits} hits, {misses} misses")
+        evict_ai_cache(cache_path)
+    summary = usage.summary().values()
+    print(f"✅ AI usage: {sum(entry['calls'] for entry in summary)} requests "
+          f"({sum(entry['cached'] for entry in summary)} cached, {sum(entry['failures'] for entry in summary)} failed), "
+          f"{usage.tokens()} tokens, dropped {usage.dropped}")
+
+    #same order as infov_dict
+    message1v = {timestamp1: message1v[timestamp1] for timestamp1 in infov_dict}
+    message2v = {timestamp1: message2v[timestamp1] for timestamp1 in infov_dict}
     return message1v, message2v
     
-def call_ai_api_structure(api_key, base_url, aerosol_message, max_tokens=None):
+def call_ai_api_structure(api_key, base_url, aerosol_message, max_tokens=None, cache_path=None, limiter=None, usage=None):
     """
     max_tokens are the entire world, if input text is long, adjust the max_tokens accordingly
 
     remove: 3. **Possible Event**: describe what kind of event this represents (e.g., biomass burning, dust outbreak, sea spray).
     """
     
-    client = openai.OpenAI(
-       api_key=api_key,
-       base_url=base_url
-    )
-    
-    response = client.chat.completions.create(
+    request = dict(
         model="gpt-5",  
         messages=[
-            {"role": "system", "content": 
-             """You are an atmospheric scientist. Always respond with a clear structured summary:
-             1. **Location**: state coordinates and region.
-             2. **Aerosol Type**: describe the likely dominant aerosol. State the values in the format of (AOD x±x, SSA x±x, FVF x±x, sph x±x).
-             3. **Sources & Transport**: identify possible sources and transport pathways.
-             4. **Climate & Environment Impact**: note potential effects briefly.
-             5. **Earth Science Grand Questions and Challenges**: propose potential earth science question and challenges regarding this aerosol event.
-             Keep the format consistent every time. 
-             For long message, if several points are given, specify them into different lines start with -."""},
+            {"role": "system", "content": AI_SYSTEM_STRUCTURE},
             {"role": "user", "content": aerosol_message}
         ],
         max_tokens=max_tokens
     )
     
-    output = response.choices[0].message.content
-    return output
+    return chat_completion(api_key, base_url, request, cache_path=cache_path, limiter=limiter, \
+                           usage=usage, name="call_ai_api_structure")
 
-def call_ai_api_web(api_key, base_url, aerosol_message, max_tokens=None):
+def call_ai_api_web(api_key, base_url, aerosol_message, max_tokens=None, cache_path=None, limiter=None, usage=None):
     """
     max_tokens are the entire world, if input text is long, adjust the max_tokens accordingly
     """
-    client = openai.OpenAI(
-       api_key=api_key,
-       base_url=base_url
-    )
-
-    response = client.chat.completions.create(
+    request = dict(
         model="gpt-5",  # use GPT-5 (or gpt-4o-mini if faster/cheaper)
         tools=[{"type": "web_search"}],
         messages=[
@@ -141,19 +525,14 @@ def call_ai_api_web(api_key, base_url, aerosol_message, max_tokens=None):
         ],
         max_tokens=max_tokens
     )
-    output = response.choices[0].message.content
-    return output
+    return chat_completion(api_key, base_url, request, cache_path=cache_path, limiter=limiter, \
+                           usage=usage, name="call_ai_api_web")
     
-def call_ai_api_simple(api_key, base_url, aerosol_message, max_tokens=None):
+def call_ai_api_simple(api_key, base_url, aerosol_message, max_tokens=None, cache_path=None, limiter=None, usage=None):
     """
     max_tokens are the entire world, if input text is long, adjust the max_tokens accordingly
     """
-    client = openai.OpenAI(
-       api_key=api_key,
-       base_url=base_url
-    )
-    
-    response = client.chat.completions.create(
+    request = dict(
         model="gpt-5",  # use GPT-5 (or gpt-4o-mini if faster/cheaper)
         messages=[
             {"role": "system", "content": "You are an atmospheric scientist."},
@@ -161,5 +540,5 @@ def call_ai_api_simple(api_key, base_url, aerosol_message, max_tokens=None):
         ],
         max_tokens=max_tokens
     )
-    output = response.choices[0].message.content
-    return output
\ No newline at end of file
+    return chat_completion(api_key, base_url, request, cache_path=cache_path, limiter=limiter, \
+                           usage=usage, name="call_ai_api_simple")
@@ -0,0 +1,371 @@
+"""
+Local granule cache shared by rapid, spotlight and SLURM array runs
+
+Granules are stored once under <cache_path>/<product>/<file_name>, where product is
+the file name without its timestamp (e.g. PACE_HARP2.L1C.V3.5km), and hard linked
+(or symlinked across file systems) into the per-run data_l2/data_l1c folders.
+Removing a per-run folder only removes the links.
+
+index.json keeps the size and last use time of each granule for LRU eviction,
+guarded by a file lock since several jobs may share the same cache.
+
+Search results (file_search / earthaccess.search_data) are kept under <cache_path>/search
+for SEARCH_TTL seconds, keyed by product and time span.
+
+The processed-granule ledger (load_ledger/update_ledger) records which granules a product
+has already gone through, for the incremental mode of orca_run.py.
+
+The plots of a granule are tagged with a fingerprint of the L2 file and the plot parameters
+(PLOT_SIDECAR in the plot folder of the timestamp, with the info of the granule), so plotting
+it again with the same data and style is skipped (plot_cache_get/plot_cache_put).
+
+AI responses are kept under <cache_path>/ai, one json file per request keyed by the model and
+the messages (ai_cache_get/ai_cache_put), reused for AI_TTL seconds; evict_ai_cache removes the
+expired ones and the least recently used ones above AI_CACHE_MAX_MB.
+"""
+
+import os
+import json
+import time
+import hashlib
+import shutil
+import threading
+try:
+    import fcntl
+except ImportError:
+    #not on windows, the index lock then only holds between the threads of one process
+    fcntl = None
+from contextlib import contextmanager, nullcontext
+
+from tools.orca_data import extract_timestamp, check_netcdf_file
+
+CACHE_INDEX = "index.json"
+SEARCH_SEEN = "search_seen.json"
+PLOT_SIDECAR = ".orca_plot.json"
+INDEX_LOCK = threading.Lock()  #without fcntl
+
+def granule_cache_key(file_name):
+    """
+    product/file_name, product is the file name without the timestamp
+    """
+    file_name = os.path.basename(file_name)
+    timestamp3 = extract_timestamp(file_name)
+    if timestamp3:
+        product = file_name.replace("."+timestamp3+".", ".").removesuffix(".nc")
+    else:
+        product = "misc"
+    return product+"/"+file_name
+
+@contextmanager
+def locked_index(cache_path, index_name=CACHE_INDEX):
+    """
+    Read/modify/write a json index of the cache under an exclusive lock
+    """
+    os.makedirs(cache_path, exist_ok=True)
+    with open(os.path.join(cache_path, ".lock"), "w") as lock, (INDEX_LOCK if fcntl is None else nullcontext()):
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(os.path.join(cache_path, index_name)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        yield index
+        tmp = os.path.join(cache_path, index_name+".tmp")
+        with open(tmp, "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp, os.path.join(cache_path, index_name))
+
+def link_file(src, dst):
+    """
+    Hard link src to dst, fall back to a symlink across file systems
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        os.symlink(os.path.abspath(src), dst)
+
+def cache_fetch(cache_path, file_name, output_folder):
+    """
+    Link a cached granule into output_folder.
+
+    Returns:
+    -------
+    output_file_path or None if the granule is not in the cache
+    """
+    if not cache_path:
+        return None
+    key = granule_cache_key(file_name)
+    cache_file = os.path.join(cache_path, key)
+    if not os.path.isfile(cache_file):
+        return None
+
+    output_file_path = os.path.join(output_folder, os.path.basename(file_name))
+    with locked_index(cache_path) as index:
+        #size recorded when the validated granule was stored
+        size = index.get(key, {}).get("size", os.path.getsize(cache_file))
+        if os.path.getsize(cache_file) != size:
+            print(f"⚠️ Cached '{os.path.basename(file_name)}' changed size, removed from cache {cache_path}")
+            os.remove(cache_file)
+            del index[key]
+            return None
+        link_file(cache_file, output_file_path)
+        index[key] = {"size": size, "last_used": time.time()}
+    #the run folder sidecar gets the size too, so the linked granule is checked against it
+    if not check_netcdf_file(output_file_path, expected_size=size):
+        os.remove(output_file_path)
+        return None
+    print(f"✅ File '{os.path.basename(file_name)}' found in cache {cache_path}")
+    return output_file_path
+
+def cache_store(cache_path, file_path):
+    """
+    Add a complete, validated granule to the cache (hard link, or copy across file systems)
+    """
+    if not cache_path:
+        return
+    key = granule_cache_key(file_path)
+    cache_file = os.path.join(cache_path, key)
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+
+    tmp = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        os.link(file_path, tmp)
+    except OSError:
+        shutil.copy2(file_path, tmp)
+    os.replace(tmp, cache_file)
+
+    with locked_index(cache_path) as index:
+        index[key] = {"size": os.path.getsize(cache_file), "last_used": time.time()}
+
+def evict_granule_cache(cache_path, max_size_gb=200):
+    """
+    Remove least recently used granules until the cache is below max_size_gb.
+    Run it between jobs, not while a run still holds symlinks into the cache.
+    """
+    if not cache_path or max_size_gb is None:
+        return []
+    removed = []
+    with locked_index(cache_path) as index:
+        #drop entries whose file has disappeared
+        for key in [key for key in index if not os.path.isfile(os.path.join(cache_path, key))]:
+            del index[key]
+
+        total = sum(entry["size"] for entry in index.values())
+        for key in sorted(index, key=lambda key: index[key]["last_used"]):
+            if total <= max_size_gb*1e9:
+                break
+            os.remove(os.path.join(cache_path, key))
+            total -= index.pop(key)["size"]
+            removed.append(key)
+
+    print(f"✅ Cache {cache_path}: {total/1e9:.2f} GB, {len(index)} granules, {len(removed)} evicted")
+    return removed
+
+SEARCH_TTL = 3600  # seconds a search result is reused
+
+def search_cache_file(cache_path, product, tspan):
+    """one json file per (product, time span) query"""
+    key = hashlib.sha1(json.dumps([str(product), [str(t) for t in tspan]]).encode()).hexdigest()
+    return os.path.join(cache_path, "search", key+".json")
+
+def search_cache_get(cache_path, product, tspan, ttl=SEARCH_TTL):
+    """
+    Return the cached search result (list of strings) of this query if younger than ttl, otherwise None
+    """
+    if not cache_path:
+        return None
+    try:
+        with open(search_cache_file(cache_path, product, tspan)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - entry["time"] > ttl:
+        return None
+    print(f"✅ Search result of {product} {tspan} from cache ({len(entry['results'])} entries)")
+    return entry["results"]
+
+def search_cache_put(cache_path, product, tspan, results):
+    """
+    Save a search result (file names, file_search lines or data links).
+
+    Returns:
+    -------
+    new_timestamps : list
+        Timestamps in results never returned before by any query of this product.
+    """
+    if not cache_path:
+        return []
+    file_cache = search_cache_file(cache_path, product, tspan)
+    os.makedirs(os.path.dirname(file_cache), exist_ok=True)
+    tmp = f"{file_cache}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"product": product, "tspan": list(tspan), "time": time.time(), "results": list(results)}, f)
+    os.replace(tmp, file_cache)
+
+    timestamps = [timestamp3 for timestamp3 in map(extract_timestamp, results) if timestamp3]
+    with locked_index(cache_path, SEARCH_SEEN) as seen_all:
+        seen = set(seen_all.get(str(product), []))
+        new_timestamps = sorted(set(timestamps) - seen)
+        seen_all[str(product)] = sorted(seen | set(timestamps))
+    if new_timestamps:
+        print(f"🆕 {len(new_timestamps)} new granules of {product} since the last query: {new_timestamps}")
+    return new_timestamps
+
+def to_json_safe(value):
+    """convert numpy scalars/arrays (e.g. in info dictionaries) into plain python for json"""
+    if isinstance(value, dict):
+        return {str(key): to_json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json_safe(item) for item in value]
+    if hasattr(value, "tolist"):
+        return to_json_safe(value.tolist())
+    return value
+
+def load_ledger(ledger_file):
+    """
+    Processed-granule ledger of one product: {timestamp: entry}
+    entry: {"status": "selected"/"rejected", "file", "plot_path", "selection", "info", "message1", "message2", "time"}
+    selection: thresholds the granule was selected/rejected with, see ledger_done
+    """
+    try:
+        with open(ledger_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def ledger_done(ledger, selection):
+    """
+    timestamps of the ledger processed with the same selection thresholds (e.g. aod_min, npixel_min, criteria),
+    the other granules go through selection again
+    """
+    selection = to_json_safe(selection)
+    return {timestamp3 for timestamp3, entry in ledger.items() if entry.get("selection") == selection}
+
+def update_ledger(ledger_file, entries):
+    """
+    Add or replace ledger entries {timestamp: entry}, under the cache file lock
+    """
+    folder, name = os.path.split(os.path.abspath(ledger_file))
+    with locked_index(folder, name) as ledger:
+        for timestamp3, entry in entries.items():
+            ledger[timestamp3] = to_json_safe(dict(entry, time=time.time()))
+    print(f"✅ Ledger {ledger_file}: {len(entries)} granules recorded")
+
+def plot_fingerprint(file1, params):
+    """
+    sha1 of the L2 granule (file name, size, mtime) and the plot parameters,
+    the name rather than the full path, so the same granule linked into another run folder matches
+    """
+    stat = os.stat(file1)
+    key = [os.path.basename(os.fspath(file1)), stat.st_size, stat.st_mtime_ns, to_json_safe(params)]
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def plot_cache_get(plot_folder, fingerprint):
+    """
+    info of the granule if its plots in plot_folder have this fingerprint and are all there, otherwise None
+    """
+    try:
+        with open(os.path.join(plot_folder, PLOT_SIDECAR)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get("fingerprint") != fingerprint:
+        return None
+    if not all(os.path.isfile(os.path.join(plot_folder, file1)) for file1 in entry["files"]):
+        return None
+    return entry["info"]
+
+def plot_cache_put(plot_folder, fingerprint, info, files):
+    """
+    Tag the plots of a granule (files, relative to plot_folder) with their fingerprint and info
+    """
+    tmp = os.path.join(plot_folder, f"{PLOT_SIDECAR}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump({"fingerprint": fingerprint, "info": to_json_safe(info), "files": list(files), \
+                   "time": time.time()}, f, indent=1)
+    os.replace(tmp, os.path.join(plot_folder, PLOT_SIDECAR))
+
+AI_TTL = 30*24*3600  # seconds an AI response is reused
+AI_CACHE_MAX_MB = 100
+
+def ai_cache_file(cache_path, request):
+    """one json file per AI request (model, messages and the other parameters of the request)"""
+    key = hashlib.sha1(json.dumps(to_json_safe(request), sort_keys=True).encode()).hexdigest()
+    return os.path.join(cache_path, "ai", key+".json")
+
+def ai_cache_get(cache_path, request, ttl=AI_TTL):
+    """
+    Return the cached response (text) of this request if younger than ttl, otherwise None
+    """
+    if not cache_path:
+        return None
+    file_cache = ai_cache_file(cache_path, request)
+    try:
+        with open(file_cache) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - entry["time"] > ttl:
+        return None
+    #the modification time is the last use, for evict_ai_cache
+    try:
+        os.utime(file_cache)
+    except OSError:
+        pass
+    return entry["response"]
+
+def ai_cache_put(cache_path, request, response):
+    """Save the response (text) of an AI request"""
+    if not cache_path:
+        return
+    file_cache = ai_cache_file(cache_path, request)
+    os.makedirs(os.path.dirname(file_cache), exist_ok=True)
+    #requests run on several threads
+    tmp = f"{file_cache}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"request": to_json_safe(request), "time": time.time(), "response": response}, f)
+    os.replace(tmp, file_cache)
+
+def evict_ai_cache(cache_path, max_size_mb=AI_CACHE_MAX_MB, ttl=AI_TTL):
+    """
+    Remove the AI responses older than ttl, then the least recently used ones until
+    the AI cache is below max_size_mb
+    """
+    folder = os.path.join(cache_path, "ai") if cache_path else None
+    if not folder or not os.path.isdir(folder):
+        return []
+    entries = []
+    for name in os.listdir(folder):
+        if not name.endswith(".json"):
+            continue
+        file_cache = os.path.join(folder, name)
+        try:
+            stat = os.stat(file_cache)
+        except OSError:
+            continue
+        try:
+            with open(file_cache) as f:
+                created = json.load(f)["time"]
+        except (OSError, ValueError, KeyError):
+            #unreadable, removed as expired
+            created = 0
+        entries.append((stat.st_mtime, stat.st_size, created, file_cache))
+
+    removed = []
+    total = sum(entry[1] for entry in entries)
+    now = time.time()
+    for last_used, size, created, file_cache in sorted(entries):
+        if now - created <= ttl and total <= max_size_mb*1e6:
+            continue
+        try:
+            os.remove(file_cache)
+        except OSError:
+            continue
+        total -= size
+        removed.append(os.path.basename(file_cache))
+
+    print(f"✅ AI cache {folder}: {total/1e6:.2f} MB, {len(entries)-len(removed)} responses, {len(removed)} evicted")
+    return removed
@@ -1,14 +1,24 @@
 """
 tools to deal with data
+
+xarray is imported on the first read of a file, selecting granules from the
+summary index (tools/orca_index.py) does not need it
 """
 
 import os
 import glob
 import re
-import requests
-import subprocess
+import json
+import struct
+import hashlib
+import threading
 import numpy as np
-import xarray as xr
+import netCDF4
+
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+NETCDF3_SIGNATURES = (b"CDF\x01", b"CDF\x02", b"CDF\x05")
+VALID_SIDECAR = ".orca_valid.json"
+_sidecar_lock = threading.Lock()
 
 def extract_timestamp(filename):
     """
@@ -21,44 +31,337 @@ def extract_timestamp(filename):
         str: Extracted timestamp if found, otherwise None.
     """
     pattern = r"\.(\d{8}T\d{6})\."
-    match = re.search(pattern, filename)
+    match = re.search(pattern, os.fspath(filename))
     if match:
         return match.group(1)
     return None
 
+def has_netcdf_signature(file1):
+    """
+    Check the netCDF3 magic number or the HDF5 (netCDF4) signature.
+    The HDF5 superblock may sit after a user block at offset 0, 512, 1024, 2048, ...
+    """
+    size = os.path.getsize(file1)
+    with open(file1, "rb") as f:
+        if f.read(4) in NETCDF3_SIGNATURES:
+            return True
+        offset = 0
+        while offset + len(HDF5_SIGNATURE) <= size:
+            f.seek(offset)
+            if f.read(len(HDF5_SIGNATURE)) == HDF5_SIGNATURE:
+                return True
+            offset = 512 if offset == 0 else offset*2
+    return False
+
+def hdf5_end_of_file(file1):
+    """
+    End of file address (base address + end of file address of the superblock) an HDF5 file
+    must reach, None if it is not an HDF5 file or the superblock cannot be read
+    """
+    size = os.path.getsize(file1)
+    with open(file1, "rb") as f:
+        offset = 0
+        while offset + len(HDF5_SIGNATURE) <= size:
+            f.seek(offset)
+            if f.read(len(HDF5_SIGNATURE)) == HDF5_SIGNATURE:
+                break
+            offset = 512 if offset == 0 else offset*2
+        else:
+            return None
+        header = f.read(40)
+        if len(header) < 1:
+            return None
+        version = header[0]
+        if version in (0, 1):
+            #versions, sizes of offsets/lengths, group K values, flags (and indexed storage K in version 1)
+            if len(header) < 8:
+                return None
+            size_offsets = header[5]
+            start = 16 if version == 0 else 20
+        elif version in (2, 3):
+            size_offsets = header[1]
+            start = 4
+        else:
+            return None
+        fmt = {4: "<I", 8: "<Q"}.get(size_offsets)
+        if fmt is None:
+            return None
+        f.seek(offset + len(HDF5_SIGNATURE) + start)
+        #base address, then (free space/extension address) and end of file address
+        addresses = f.read(3*size_offsets)
+        if len(addresses) < 3*size_offsets:
+            return None
+        base, _, end_of_file = struct.unpack("<"+fmt[1]*3, addresses)
+        undefined = 2**(8*size_offsets) - 1
+        if undefined in (base, end_of_file):
+            return None
+        return base + end_of_file
+
+def can_open_netcdf(file1):
+    """
+    open the file with netCDF4, the check used when the size cannot be verified otherwise
+    (netCDF3 files, not used by PACE, open even when truncated)
+    """
+    try:
+        with netCDF4.Dataset(file1):
+            return True
+    except Exception:
+        return False
+
+def file_checksum(file1, algorithm="sha1", chunk_size=1024*1024):
+    """
+    Checksum of the file, sha1 is what the oceandata file_search API reports.
+    """
+    h = hashlib.new(algorithm)
+    with open(file1, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def load_valid_sidecar(folder):
+    """
+    Read the validation sidecar of a folder: {file_name: {size, mtime_ns, valid, ...}}
+    """
+    try:
+        with open(os.path.join(folder, VALID_SIDECAR)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def update_valid_sidecar(folder, file_name, entry):
+    """
+    Add or replace one entry of the validation sidecar, written atomically.
+    """
+    with _sidecar_lock:
+        records = load_valid_sidecar(folder)
+        records[file_name] = entry
+        tmp = os.path.join(folder, f"{VALID_SIDECAR}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(records, f, indent=1)
+        os.replace(tmp, os.path.join(folder, VALID_SIDECAR))
+
+def check_netcdf_file(file1, expected_size=None, checksum=None):
+    """
+    In-process replacement of `ncdump -h` to check a downloaded granule.
+
+    The file is valid if it has a netCDF/HDF5 signature, its size matches
+    expected_size (given, or recorded at download time from Content-Length),
+    and its sha1 matches checksum when one is given. Without expected_size, the file
+    must reach the end of file address of its HDF5 superblock (or open with netCDF4).
+
+    The result is cached in a sidecar (VALID_SIDECAR) in the same folder, keyed
+    by file size and mtime, so unchanged files are never read again.
+    """
+    folder, file_name = os.path.split(os.path.abspath(file1))
+    try:
+        stat = os.stat(file1)
+    except OSError:
+        return False
+
+    entry = load_valid_sidecar(folder).get(file_name, {})
+    if expected_size is None:
+        expected_size = entry.get("expected_size")
+    if checksum is None:
+        checksum = entry.get("checksum")
+
+    #unchanged since the last check
+    if entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns \
+       and entry.get("expected_size") == expected_size and entry.get("checksum") == checksum:
+        return entry["valid"]
+
+    valid = has_netcdf_signature(file1)
+    if valid and expected_size is not None:
+        valid = stat.st_size == expected_size
+    elif valid:
+        #no recorded size (older runs, files linked from the cache): the HDF5 superblock tells
+        #how long the file must be, otherwise open it once, the result is kept in the sidecar
+        end_of_file = hdf5_end_of_file(file1)
+        valid = stat.st_size >= end_of_file if end_of_file is not None else can_open_netcdf(file1)
+    if valid and checksum is not None:
+        valid = file_checksum(file1) == checksum
+
+    update_valid_sidecar(folder, file_name, {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, \
+                                             "expected_size": expected_size, "checksum": checksum, \
+                                             "valid": valid})
+    return valid
+
+def variable_groups(file1):
+    """
+    {variable name: group path} of all groups in the file, read from the metadata only.
+    A name found in several groups keeps the first one (root first).
+    """
+    groups = {}
+    def walk(group, path):
+        for key in group.variables:
+            groups.setdefault(key, path)
+        for name, child in group.groups.items():
+            walk(child, path.rstrip("/")+"/"+name)
+    with netCDF4.Dataset(file1) as nc:
+        walk(nc, "/")
+    return groups
+
+def read_variables(file1, keys, index=None):
+    """
+    Read only keys, opening only the groups holding them.
+
+    index: {key: indexer}, e.g. {"i": (slice(None), slice(None), iv, iwvv)}, applied
+    lazily so only the slice is read from disk.
+    Keys not in the file are left out of the result.
+    """
+    import xarray as xr
+    index = index or {}
+    groups = variable_groups(file1)
+    data = {}
+    for group in sorted({groups[key] for key in keys if key in groups}):
+        with xr.open_dataset(file1, group=group) as dataset:
+            for key in keys:
+                if groups.get(key) == group:
+                    var = dataset[key]
+                    if key in index:
+                        var = var[index[key]]
+                    data[key] = var.values
+    return data
+
+def read_l1c_rgb(file4, iv=[40, 5, 85], iwvv=0, ivp=None, iwvvp=None):
+    """
+    lon, lat and the rgb slices i[:, :, iv, iwvv], dolp[:, :, ivp, iwvvp] of a L1C file,
+    without loading the other angles and bands.
+    A slice is an array of None (as before) when its indices are not given.
+    """
+    keys = ["longitude", "latitude"]
+    index = {}
+    if (iv is not None) and (iwvv is not None):
+        keys.append("i")
+        index["i"] = (slice(None), slice(None), iv, iwvv)
+    if (ivp is not None) and (iwvvp is not None):
+        keys.append("dolp")
+        index["dolp"] = (slice(None), slice(None), ivp, iwvvp)
+    data = read_variables(file4, keys, index=index)
+
+    lon2, lat2 = data["longitude"], data["latitude"]
+    tmp2i = data["i"] if "i" in index else np.full_like(lon2, None, dtype=object)
+    tmp2dolp = data["dolp"] if "dolp" in index else np.full_like(lon2, None, dtype=object)
+    return lon2, lat2, tmp2i, tmp2dolp
+
+class L2Granule:
+    """
+    One L2 file, opened once and shared by select_data, make_plot and the statistics.
+
+    Only the groups holding the requested variables are opened (lazily, on first use),
+    and variables are read with their wavelength index applied, e.g. get("aot", iwv550).
+    Decoded variables (get) and filter masks (criteria_mask, filter) are kept until close().
+    Behaves like the file path (str, os.fspath), so it can be passed to the download tools.
+    """
+
+    def __init__(self, file1):
+        self.file = os.fspath(file1)
+        self.timestamp = extract_timestamp(self.file)
+        self._groups = None
+        self._datasets = {}
+        self._values = {}
+        self._filters = {}
+
+    def __str__(self):
+        return self.file
+
+    def __repr__(self):
+        return f"L2Granule({self.file!r})"
+
+    def __fspath__(self):
+        return self.file
+
+    def variable(self, key):
+        """lazy DataArray of one variable, its group is opened on first access"""
+        if self._groups is None:
+            self._groups = variable_groups(self.file)
+        group = self._groups[key]
+        if group not in self._datasets:
+            import xarray as xr
+            self._datasets[group] = xr.open_dataset(self.file, group=group)
+        return self._datasets[group][key]
+
+    def get(self, key, iwv=None):
+        """
+        decoded values of one variable, read from the file only once
+        iwv: index of the third (wavelength) dimension, only that slice is read
+        """
+        if (key, iwv) not in self._values:
+            var = self.variable(key)
+            if iwv is not None:
+                var = var[:, :, iwv]
+            self._values[(key, iwv)] = var.values
+        return self._values[(key, iwv)]
+
+    def criteria_mask(self, criteria = (30, 20, 2.0)):
+        """
+        pixels passing criteria = (nv_ref_min, nv_dolp_min, chi2_max), without the aot threshold
+        """
+        key = tuple(criteria)
+        if key in self._filters:
+            return self._filters[key]
+
+        nv_ref_min, nv_dolp_min, chi2_max = criteria
+
+        chi2 = self.get("chi2")
+        try:
+            nv_ref = self.get("nv_ref")
+            nv_dolp = self.get("nv_dolp")
+            mask = (nv_ref>=nv_ref_min) & (nv_dolp>=nv_dolp_min) & (chi2 <=chi2_max)
+            print("use nv_ref, nv_dolp, chi2")
+        except:
+            #when nv are not available
+            mask = (chi2 <=chi2_max)
+            print("use chi2 only, nv_ref, nv_dolp not found")
+
+        self._filters[key] = mask
+        return mask
+
+    def filter(self, iwv550 = 1, aot_min = 0.15, criteria = (30, 20, 2.0)):
+        """
+        same as filter_data, the result is kept for each (iwv550, aot_min, criteria)
+        """
+        key = (iwv550, aot_min, tuple(criteria))
+        if key in self._filters:
+            return self._filters[key]
+
+        aot550 = self.get("aot", iwv550)
+        data = aot550
+        #total non-nan data
+        npixel_valid0 = np.sum(~np.isnan(data))
+
+        filter1 = (aot550 >= aot_min) & self.criteria_mask(criteria)
+
+        #total non-nan data after filtering
+        data = np.where(filter1,data , np.nan)
+        npixel_valid1 = np.sum(~np.isnan(data))
+
+        self._filters[key] = (npixel_valid0, npixel_valid1, filter1)
+        return self._filters[key]
+
+    def close(self):
+        """release the file and the cached arrays"""
+        for dataset in self._datasets.values():
+            dataset.close()
+        self._datasets = {}
+        self._values = {}
+        self._filters = {}
+
+def as_l2_granule(file1):
+    """wrap a path into an L2Granule, granules are returned unchanged"""
+    return file1 if isinstance(file1, L2Granule) else L2Granule(file1)
+
 def filter_data(file1, iwv550 = 1, aot_min = 0.15,  criteria = (30, 20, 2.0)):
     """
     check the file, and output total number of pixels agree with the rules based on:
     aot, nv_ref, nv_dolp, chi2_max
 
     criteria = (nv_ref_min, nv_dolp_min, chi2_max)
-    
-    """
-
-    nv_ref_min, nv_dolp_min, chi2_max = criteria
-    
-    datatree = xr.open_datatree(file1)
-    dataset = xr.merge(datatree.to_dict().values())
-    
-
-    chi2 = dataset["chi2"].values
-    aot = dataset["aot"].values
-    data = aot[:, :, iwv550]
-    #total non-nan data
-    npixel_valid0 = np.sum(~np.isnan(data))
 
+    file1 can be a path or an L2Granule, a path is opened and closed here
+    """
+    granule = as_l2_granule(file1)
     try:
-        nv_ref = dataset["nv_ref"].values
-        nv_dolp = dataset["nv_dolp"].values
-        filter1 = (aot[:, :, iwv550] >= aot_min) & (nv_ref>=nv_ref_min) & (nv_dolp>=nv_dolp_min) & (chi2 <=chi2_max)
-        print("use nv_ref, nv_dolp, chi2")
-    except:
-        #when nv are not available
-        filter1 = (aot[:, :, iwv550] >= aot_min) & (chi2 <=chi2_max)
-        print("use chi2 only, nv_ref, nv_dolp not found")
-
-    #total non-nan data after filtering
-    data = np.where(filter1,data , np.nan)
-    npixel_valid1 = np.sum(~np.isnan(data))
-
-    return npixel_valid0, npixel_valid1, filter1
\ No newline at end of file
+        return granule.filter(iwv550=iwv550, aot_min=aot_min, criteria=criteria)
+    finally:
+        if granule is not file1:
+            granule.close()
@@ -0,0 +1,108 @@
+"""
+Headless aerosol event detection: selection and statistics only, no plot, no html, no AI
+
+Selects the L2 granules as orca_run.py does (select_data), computes the statistics of the
+L2 variables over the pixels passing aod_min_plot and criteria (tools/orca_stats.py),
+and writes them to a json file, e.g.
+
+python tools/orca_detect.py --product harp2_fastmapol --l2_files "pace_tmp/*/L2*/*.nc" --output events.json
+
+matplotlib, cartopy, openai and earthaccess are not imported, xarray only on the first file
+read, so the run starts in a fraction of a second (see scripts/bench_startup.py).
+"""
+
+import os
+import sys
+import json
+import glob
+import argparse
+
+#add the path of the tools
+mapol_path = os.environ.get('MAPOLTOOL_LAB_PATH') or '/mnt/mfs/mgao1/analysis/github/pace-orca/'
+sys.path.append(mapol_path)
+
+from tools.orca_utility import set_default_values
+from tools.orca_pace import get_product_settings, get_variable_settings
+from tools.orca_index import select_data, granule_footprint
+from tools.orca_stats import granule_statistics
+from tools.orca_cache import to_json_safe
+
+def detect_events(filelist_l2, aod_min=0.3, aod_min_plot=0.3, npixel_min=100*100, iwv550=1, iwv_aod=1, iwv_rrs=0, \
+                  criteria=(30, 20, 2.0), key1v=['aot'], vmin1v=None, vmax1v=None, scale1v=None, index_path=None):
+    """
+    select_data, then the info of each selected granule, as plot_l1c_l2 fills it
+    (timestamp, boundingbox, center, pixel, [mean, std] of each variable and stats)
+
+    Returns:
+    -------
+    infov_dict: {timestamp: info}
+    """
+    filev2 = select_data(filelist_l2, aod_min=aod_min, npixel_min=npixel_min, \
+                         iwv550=iwv550, criteria=criteria, index_path=index_path)
+    ranges = list(zip(vmin1v, vmax1v)) if vmin1v is not None else None
+
+    infov_dict = {}
+    for granule in filev2:
+        try:
+            info = {'aod_min': aod_min_plot, 'timestamp': granule.timestamp, 'file': os.path.basename(granule.file)}
+            info['boundingbox'], info['center'] = granule_footprint(granule)
+            npixel_valid0, npixel_valid1, filter1 = granule.filter(iwv550=iwv_aod, aot_min=aod_min_plot, criteria=criteria)
+            stats = granule_statistics(granule, key1v, filter1, iwv_aod=iwv_aod, iwv_rrs=iwv_rrs, \
+                                       scale1v=scale1v, ranges=ranges)
+            if('aot' in stats):
+                info['pixel'] = stats['aot']['count']
+            for key1, stat in stats.items():
+                info[key1] = [stat['mean'], stat['std']]
+            info['stats'] = stats
+            infov_dict[granule.timestamp] = info
+            print(f"✅ {granule.timestamp}: {info.get('pixel')} pixels")
+        except Exception as e:
+            print(f"❌ Failed statistics of {granule}: {e}")
+        finally:
+            granule.close()
+    return infov_dict
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Select PACE L2 granules and write their statistics, without plots.")
+
+    parser.add_argument("--product", type=str, required=True, help="product: harp2_fastmapol, ...")
+    parser.add_argument("--l2_files", type=str, nargs="+", required=True,
+                        help="L2 files or glob patterns, e.g. the L2 folder of an earlier orca_run.py")
+    parser.add_argument("--output", type=str, default=None,
+                        help="json file of the statistics (default: <product>_events.json)")
+    parser.add_argument("--aod_min_default", type=float, default=None, \
+                        help="set aod_min, if not set, use existing values")
+    parser.add_argument("--aod_min_plot_default", type=float, default=None, \
+                        help="set aod_min_plot (pixels of the statistics), if not set, use existing values")
+    parser.add_argument("--npixel_min_default", type=float, default=None, \
+                        help="set npixel_min, if not set, use existing values")
+    parser.add_argument("--index_path", type=str, default=os.environ.get('MAPOLTOOL_INDEX_PATH'),
+                        help="granule summary index (sqlite) used by the selection (default: $MAPOLTOOL_INDEX_PATH, no index if unset)")
+
+    args = parser.parse_args()
+
+    settings = get_product_settings(args.product)
+    if settings is None:
+        sys.exit(1)
+    dict1 = {'aod_min':[settings['aod_min'], args.aod_min_default], \
+             'aod_min_plot':[settings['aod_min_plot'], args.aod_min_plot_default],\
+             'npixel_min':[settings['npixel_min'], args.npixel_min_default]}
+    aod_min, aod_min_plot, npixel_min = set_default_values(dict1)
+    print("aod_min, aod_min_plot, npixel_min", aod_min, aod_min_plot, npixel_min)
+    key1v, vmin1v, vmax1v, cmap1v, scale1v = get_variable_settings(settings['nv_max'])
+
+    filelist_l2 = sorted({file1 for pattern in args.l2_files for file1 in glob.glob(pattern)})
+    print("total file before selection", len(filelist_l2))
+
+    infov_dict = detect_events(filelist_l2, aod_min=aod_min, aod_min_plot=aod_min_plot, npixel_min=npixel_min, \
+                               iwv550=settings['iwv550'], iwv_aod=settings['iwv_aod'], iwv_rrs=settings['iwv_rrs'], \
+                               criteria=settings['criteria'], key1v=key1v, vmin1v=vmin1v, vmax1v=vmax1v, \
+                               scale1v=scale1v, index_path=args.index_path)
+    print("total file after selection", len(infov_dict))
+
+    output = args.output or args.product+'_events.json'
+    result = {'product': args.product, 'aod_min': aod_min, 'aod_min_plot': aod_min_plot, 'npixel_min': npixel_min, \
+              'criteria': settings['criteria'], 'nfile': len(filelist_l2), 'granules': infov_dict}
+    with open(output, 'w') as f:
+        json.dump(to_json_safe(result), f, indent=1)
+    print(f"✅ Statistics of {len(infov_dict)} granules saved to {output}")
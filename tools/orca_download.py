@@ -5,22 +5,122 @@ Meng Gao, Sep 25, 2025
 
 Need cloud access if earthaccess is used. 
 Need appkey 
+
+earthaccess is imported by the cloud functions only, the web download and the
+selection tools do not pay for its import
 """
 
 import os
+import json
 import time
+import queue
+import itertools
+import random
+import threading
 import requests
-import subprocess
-import earthaccess
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from requests.exceptions import RequestException
 
 import re
 from datetime import datetime
-from tools.orca_data import extract_timestamp
+from tools.orca_data import extract_timestamp, check_netcdf_file
+from tools.orca_cache import cache_fetch, cache_store, search_cache_get, search_cache_put, SEARCH_TTL
 #from tools.orca_utility import *
 
+OB_DAAC_API = "https://oceandata.sci.gsfc.nasa.gov/api/file_search"
+OB_DAAC_GETFILE = "https://oceandata.sci.gsfc.nasa.gov/cgi/getfile/"
+HTTP_TIMEOUT = (30, 300)  # (connect, read) seconds, so a stalled transfer is retried instead of hanging
+
+class RetryPolicy:
+    """
+    Retry with jittered exponential backoff, shared by all download functions.
+
+    Parameters:
+    ----------
+    max_attempts : int
+        Total number of attempts per call.
+    base_delay, max_delay : float
+        Delay before retry n is drawn from [(1-jitter)*d, d], d = min(max_delay, base_delay*2**n).
+    retry_status : tuple
+        HTTP status codes worth retrying, other HTTP errors (e.g. 404) fail at once.
+    deadline : float or None
+        Give up a call when the next retry would start later than deadline seconds after its first attempt.
+
+    Every attempt is recorded in self.attempts (name, attempt, seconds, error) and
+    summarized by summary(), to diagnose slow days.
+    """
+    def __init__(self, max_attempts=4, base_delay=5, max_delay=120, jitter=0.5, \
+                 retry_status=(408, 429, 500, 502, 503, 504), deadline=900):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_status = retry_status
+        self.deadline = deadline
+        self.attempts = []
+        self._lock = threading.Lock()
+
+    def get_delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay*2**attempt)
+        return delay*(1 - self.jitter*random.random())
+
+    def is_retryable(self, e, retry_any=False):
+        response = getattr(e, "response", None)
+        if isinstance(e, requests.HTTPError) and response is not None:
+            return response.status_code in self.retry_status
+        if isinstance(e, (RequestException, ConnectionError, TimeoutError)):
+            return True
+        return retry_any
+
+    def call(self, func, *args, name=None, retry_any=False, **kwargs):
+        """
+        Run func(*args, **kwargs) under this policy and return its result.
+        retry_any: also retry exceptions that are not network errors (e.g. from earthaccess)
+        """
+        name = name or getattr(func, "__name__", "call")
+        t_start = time.monotonic()
+        for attempt in range(self.max_attempts):
+            t0 = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+                self._record(name, attempt, time.monotonic() - t0, None)
+                return result
+            except Exception as e:
+                self._record(name, attempt, time.monotonic() - t0, e)
+                delay = self.get_delay(attempt)
+                if not self.is_retryable(e, retry_any) or attempt == self.max_attempts - 1:
+                    print(f"❌ {name} failed after {attempt + 1} attempt(s): {e}")
+                    raise
+                if self.deadline is not None and time.monotonic() - t_start + delay > self.deadline:
+                    print(f"❌ {name} failed, deadline of {self.deadline} s reached: {e}")
+                    raise
+                print(f"⚠️ {name} attempt {attempt + 1} failed: {e}, retrying in {delay:.1f} s")
+                time.sleep(delay)
+
+    def _record(self, name, attempt, seconds, error):
+        with self._lock:
+            self.attempts.append({"name": name, "attempt": attempt, "seconds": seconds, \
+                                  "error": None if error is None else type(error).__name__})
+
+    def summary(self):
+        """Number of calls, attempts, failures and time spent, per function name"""
+        summary = {}
+        with self._lock:
+            for record in self.attempts:
+                entry = summary.setdefault(record["name"], {"calls": 0, "attempts": 0, "failures": 0, \
+                                                            "seconds": 0.0, "max_seconds": 0.0})
+                entry["calls"] += record["attempt"] == 0
+                entry["attempts"] += 1
+                entry["failures"] += record["error"] is not None
+                entry["seconds"] += record["seconds"]
+                entry["max_seconds"] = max(entry["max_seconds"], record["seconds"])
+        return summary
+
+#default policy used by every download function unless one is passed in
+retry_policy = RetryPolicy()
+
 def format_tspan(tspan):
     """
     Format tspan tuple based on whether it contains date-only or datetime strings.
@@ -54,53 +154,307 @@ def format_tspan(tspan):
 
     return tspan_web
 
-def download_with_retry(granules, local_path, max_retries=3):
+def download_with_retry(granules, local_path, policy=None):
     """
-    Add retry
+    earthaccess.download under the shared retry policy
     """
-    for attempt in range(max_retries):
-        try:
-            files = earthaccess.download(granules, local_path)
-            return files
-        except (RequestException, Exception) as e:
-            print(f"Download attempt {attempt + 1} failed: {e}")
-            if attempt < max_retries - 1:
-                print(f"Retrying in 30 seconds...")
-                time.sleep(30)
-            else:
-                print("All retry attempts failed")
-                raise e
+    import earthaccess
+    policy = policy or retry_policy
+    return policy.call(earthaccess.download, granules, local_path, \
+                       name="earthaccess.download", retry_any=True)
+
+def granule_file_name(granule):
+    """file name of an earthaccess granule (or data link), from its first data link"""
+    if isinstance(granule, str):
+        return os.path.basename(granule)
+    return os.path.basename(granule.data_links()[0])
+
+def download_granule_cloud(granule, output_folder):
+    """earthaccess.download of a single granule, an empty result counts as a failure"""
+    import earthaccess
+    files = earthaccess.download([granule], output_folder, threads=1)
+    if not files:
+        raise ConnectionError(f"earthaccess returned no file for {granule_file_name(granule)}")
+    return files
+
+def iter_download_cloud(results, output_folder, nworkers=4, cache_path=None, policy=None):
+    """
+    Download earthaccess granules one per task on a thread pool, and yield local
+    file paths as soon as each granule completes (not in search order).
+    Each granule is retried on its own, a failed granule does not restart the others.
+    """
+    policy = policy or retry_policy
+    with ThreadPoolExecutor(max_workers=max(nworkers, 1)) as executor:
+        futures = {executor.submit(policy.call, download_granule_cloud, granule, output_folder, \
+                                   name="earthaccess.download", retry_any=True): granule for granule in results}
+        for future in as_completed(futures):
+            try:
+                files = future.result()
+            except Exception as e:
+                print(f"❌ Failed to download {granule_file_name(futures[future])}: {e}")
+                continue
+            for file1 in files:
+                file1 = str(file1)
+                if cache_path and check_netcdf_file(file1):
+                    cache_store(cache_path, file1)
+                yield file1
 
 def download_l2_cloud(tspan, short_name="PACE_HARP2_L2_MAPOL_OCEAN_NRT",\
-                      output_folder="./downloads"):
-    """download ata using earthaccess"""
+                      output_folder="./downloads", cache_path=None, policy=None, nworkers=1, flag_stream=False,\
+                      search_ttl=SEARCH_TTL, skip_timestamps=None):
+    """download ata using earthaccess
+    cache_path: granule cache, cached granules are linked instead of downloaded,
+                search results are reused for search_ttl seconds (as data links)
+    skip_timestamps: timestamps not to download, e.g. granules already in the processed ledger
+    policy: RetryPolicy, default retry_policy
+    nworkers: if >1, download granules individually on a thread pool (see iter_download_cloud)
+    flag_stream: return an iterator of local files in order of completion instead of a list,
+                 so the caller can start on the first granule before the last one finishes
+    """
+    policy = policy or retry_policy
     
-    results = earthaccess.search_data(
-        short_name=short_name,
-        temporal=tspan,
-        )
+    #cached results are data links, which earthaccess.download accepts as well
+    results = search_cache_get(cache_path, short_name, tspan, ttl=search_ttl)
+    if results is None:
+        import earthaccess
+        results = policy.call(earthaccess.search_data, 
+            short_name=short_name,
+            temporal=tspan,
+            name="earthaccess.search_data", retry_any=True
+            )
+        search_cache_put(cache_path, short_name, tspan, [granule.data_links()[0] for granule in results])
+
+    if skip_timestamps:
+        results = [granule for granule in results \
+                   if extract_timestamp(granule_file_name(granule)) not in skip_timestamps]
+
+    filelist_cached = []
+    if cache_path:
+        results_missing = []
+        for granule in results:
+            output_file_path = cache_fetch(cache_path, granule_file_name(granule), output_folder)
+            if output_file_path:
+                filelist_cached.append(output_file_path)
+            else:
+                results_missing.append(granule)
+        results = results_missing
+
+    if nworkers > 1 or flag_stream:
+        files_iter = itertools.chain(filelist_cached, \
+                                     iter_download_cloud(results, output_folder, nworkers=nworkers, \
+                                                         cache_path=cache_path, policy=policy))
+        return files_iter if flag_stream else list(files_iter)
 
     ###save into a temporary path as listed in filelist_l2
     #filelist_l2 = earthaccess.download(results, local_path=output_folder)
-    filelist_l2 = download_with_retry(results, output_folder)
+    filelist_l2 = download_with_retry(results, output_folder, policy=policy) if results else []
+
+    if cache_path:
+        for file1 in filelist_l2:
+            if check_netcdf_file(file1):
+                cache_store(cache_path, file1)
     
-    return filelist_l2
+    return filelist_cached + list(filelist_l2)
     
-def download_l1c_cloud(file1, l1c_path, sensor="PACE_HARP2",suite="L1C.V3.5km"):
+def download_l1c_cloud(file1, l1c_path, sensor="PACE_HARP2",suite="L1C.V3.5km", cache_path=None, policy=None):
     #timestamp3 = file1.split(sensor+".")[1].split(split)[0]
     timestamp3 = extract_timestamp(file1)
     FILENAME = sensor+"."+timestamp3+"."+suite+".nc"
     print(FILENAME)
     
-    fs = earthaccess.get_fsspec_https_session()
-    OB_DAAC_PROVISIONAL = "https://oceandata.sci.gsfc.nasa.gov/cgi/getfile/"
-    fs.get(f"{OB_DAAC_PROVISIONAL}/{FILENAME}", l1c_path)
+    if not cache_fetch(cache_path, FILENAME, l1c_path):
+        import earthaccess
+        fs = earthaccess.get_fsspec_https_session()
+        OB_DAAC_PROVISIONAL = "https://oceandata.sci.gsfc.nasa.gov/cgi/getfile/"
+        (policy or retry_policy).call(fs.get, f"{OB_DAAC_PROVISIONAL}/{FILENAME}", l1c_path, name="fsspec.get")
+        output_file_path = os.path.join(l1c_path, FILENAME)
+        if os.path.exists(output_file_path) and check_netcdf_file(output_file_path):
+            cache_store(cache_path, output_file_path)
     filelist_l1c = list(Path(l1c_path).glob("*"+timestamp3+"*.nc"))
     return filelist_l1c
 
 
+def create_session(nworkers=1):
+    """
+    One requests.Session with a connection pool large enough for nworkers threads,
+    so all downloads reuse the same TCP/TLS connections to oceandata.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(nworkers, 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def part_validator(response):
+    """If-Range value of a response: its strong ETag, otherwise its Last-Modified date (None if neither)"""
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+def fetch_file(session, download_url, output_file_path, chunk_size=64*1024):
+    """
+    Stream download_url into output_file_path+'.part' and rename it atomically when complete.
+
+    If a '.part' file is left over from an interrupted transfer, resume it with an
+    HTTP Range request, conditional (If-Range) on the ETag or Last-Modified of the transfer
+    that wrote it, kept in '.part.json': a file changed on the server since (e.g. NRT
+    reprocessing) is sent whole (200) and downloaded from zero, never spliced onto the old bytes.
+    Without a validator, or if the server ignores Range (200), the transfer restarts from zero.
+    A '.part' file already complete (416 with its size in Content-Range, or the size recorded in
+    '.part.json') is renamed without downloading it again.
+    An interrupted transfer keeps the '.part' file for the next attempt, and the
+    final name only ever holds a complete file.
+
+    The file is requested without content encoding (Accept-Encoding: identity), so Content-Length
+    counts the bytes written; if a server encodes it anyway, the bytes received are checked instead.
+
+    Returns:
+    -------
+    nbytes : int
+        Number of bytes transferred in this call (excluding resumed bytes).
+    size : int
+        Size of the complete file, checked against Content-Length when available.
+    """
+    part_file_path = output_file_path + ".part"
+    validator_file_path = part_file_path + ".json"
+    offset = os.path.getsize(part_file_path) if os.path.exists(part_file_path) else 0
+
+    validator, saved_size = None, None
+    if offset > 0:
+        try:
+            with open(validator_file_path) as f:
+                saved = json.load(f)
+            if saved.get("url") == download_url:
+                validator, saved_size = saved.get("validator"), saved.get("size")
+        except (OSError, ValueError):
+            pass
+        if validator is None:
+            print(f"⚠️ No ETag/Last-Modified for {os.path.basename(part_file_path)}, downloaded from zero")
+            offset = 0
+
+    headers = {"Accept-Encoding": "identity"}
+    if offset > 0:
+        headers.update({"Range": f"bytes={offset}-", "If-Range": validator})
+    response = session.get(download_url, stream=True, headers=headers, timeout=HTTP_TIMEOUT)
+    content_range = response.headers.get("Content-Range", "")
+    if offset > 0 and response.status_code == 416:
+        #nothing left after offset (If-Range matched): the .part file is complete if it has the size of the file
+        size = content_range.rsplit("/", 1)[-1] if content_range.startswith("bytes */") else saved_size
+        if str(size) == str(offset):
+            response.close()
+            print(f"✅ {os.path.basename(part_file_path)} already complete")
+            os.replace(part_file_path, output_file_path)
+            os.remove(validator_file_path)
+            return 0, offset
+    if response.status_code == 416 or \
+       (offset > 0 and response.status_code == 206 and not content_range.startswith(f"bytes {offset}-")):
+        # Range not satisfiable or not the one asked, the partial file is stale, start over
+        response.close()
+        offset = 0
+        response = session.get(download_url, stream=True, headers={"Accept-Encoding": "identity"}, \
+                               timeout=HTTP_TIMEOUT)
+    response.raise_for_status()  # Raise an error if the request failed
+
+    encoded = response.headers.get("Content-Encoding", "identity").lower() != "identity"
+    if offset > 0 and response.status_code == 206:
+        print(f"↪️  Resuming {os.path.basename(output_file_path)} from byte {offset}")
+        mode = "ab"
+        total = offset + int(response.headers.get("Content-Length", -offset))
+    else:
+        if offset > 0:
+            print(f"⚠️ {os.path.basename(output_file_path)} changed on the server, downloaded from zero")
+        mode = "wb"
+        offset = 0
+        total = int(response.headers.get("Content-Length", 0)) or None
+        #the validator of this transfer, for a resume of its .part file; an encoded transfer is not resumed
+        validator = None if encoded else part_validator(response)
+        if validator:
+            with open(validator_file_path, "w") as f:
+                json.dump({"url": download_url, "validator": validator, "size": total}, f)
+        elif os.path.exists(validator_file_path):
+            os.remove(validator_file_path)
+
+    nbytes = 0
+    with response, open(part_file_path, mode) as file:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            file.write(chunk)
+            nbytes += len(chunk)
+
+    #Content-Length counts the bytes on the wire, not the decoded ones of an encoded response
+    received = response.raw.tell() if encoded else nbytes
+    if total and offset + received != total:
+        raise requests.RequestException(
+            f"incomplete transfer for {download_url}: {offset+received} of {total} bytes, keep {part_file_path}")
+
+    size = offset + nbytes
+    os.replace(part_file_path, output_file_path)
+    if os.path.exists(validator_file_path):
+        os.remove(validator_file_path)
+    return nbytes, size
+
+def download_one_web(session, file_name, output_folder, checksum=None, cache_path=None, policy=None):
+    """
+    Check and download one file from the getfile service.
+    checksum: sha1 from the file_search API (cksum=1), checked when given
+    cache_path: granule cache, linked from if present, stored into after download
+    policy: RetryPolicy, a retried transfer resumes from its .part file
+
+    Returns:
+    -------
+    (output_file_path, nbytes, seconds): output_file_path is None if the file
+    already exists and is valid, or if the download failed.
+    """
+    output_file_path = os.path.join(output_folder, file_name)
+    t0 = time.perf_counter()
+    nbytes = 0
+    #an OSError of one file (disk full, permission, cache link) must not stop the other downloads of the pool
+    try:
+        # Check if the file already exists and is valid
+        if os.path.exists(output_file_path):
+            if check_netcdf_file(output_file_path, checksum=checksum):
+                print(f"✅ File '{file_name}' already exists and is valid.")
+                return None, 0, 0.0
+            else:
+                print(f"⚠️ File '{file_name}' is invalid. Deleting and re-downloading.")
+                os.remove(output_file_path)
+
+        # Link from the granule cache
+        if cache_fetch(cache_path, file_name, output_folder):
+            if check_netcdf_file(output_file_path, checksum=checksum):
+                return output_file_path, 0, 0.0
+            print(f"⚠️ Cached file '{file_name}' is invalid. Re-downloading.")
+            os.remove(output_file_path)
+
+        # Download the file
+        t0 = time.perf_counter()
+        nbytes = 0
+        try:
+            download_url = f"{OB_DAAC_GETFILE}{file_name}"
+            print(f"⬇️  Downloading: {file_name}")
+            nbytes, size = (policy or retry_policy).call(fetch_file, session, download_url, output_file_path)
+        except requests.RequestException as e:
+            print(f"❌ Failed to download {file_name}: {e}")
+            return None, nbytes, time.perf_counter() - t0
+
+        #record the expected size for later runs, and check the new file once
+        if not check_netcdf_file(output_file_path, expected_size=size, checksum=checksum):
+            print(f"❌ Downloaded file {file_name} is not a valid netCDF file (or checksum mismatch)")
+            os.remove(output_file_path)
+            return None, nbytes, time.perf_counter() - t0
+        cache_store(cache_path, output_file_path)
+
+        dt = time.perf_counter() - t0
+        print(f"✅ File downloaded: {file_name} ({nbytes/1e6:.1f} MB in {dt:.1f} s, {nbytes/1e6/max(dt, 1e-6):.1f} MB/s)")
+        return output_file_path, nbytes, dt
+    except OSError as e:
+        print(f"❌ Failed to download {file_name}: {type(e).__name__}: {e}")
+        return None, nbytes, time.perf_counter() - t0
+
 def download_l2_web(tspan_web, appkey, sensor_id=48, dtid=1546, \
-                    output_folder="./downloads", filelist_name="./filelist_harp2.txt"):
+                    output_folder="./downloads", filelist_name="./filelist_harp2.txt", nworkers=1,\
+                    flag_checksum=False, cache_path=None, policy=None, search_ttl=SEARCH_TTL, \
+                    skip_timestamps=None):
     """
     Function to search, validate, and download files for a given time range.
 
@@ -114,6 +468,17 @@ def download_l2_web(tspan_web, appkey, sensor_id=48, dtid=1546, \
         Directory to save the downloaded files.
     filelist_name : str, optional
         Path to save the file list from the API.
+    nworkers : int, optional
+        Number of concurrent downloads, all sharing one pooled requests.Session.
+    flag_checksum : bool, optional
+        Ask the API for sha1 checksums (cksum=1) and verify every file against them.
+    cache_path : str, optional
+        Granule cache shared across runs (see tools/orca_cache.py), disabled if None.
+        The file_search result is also cached there for search_ttl seconds.
+    policy : RetryPolicy, optional
+        Retry/backoff for the search and every file, default retry_policy.
+    skip_timestamps : set, optional
+        Timestamps not to download, e.g. granules already in the processed ledger.
     
     Returns:
     -------
@@ -136,7 +501,7 @@ def download_l2_web(tspan_web, appkey, sensor_id=48, dtid=1546, \
     os.makedirs(output_folder, exist_ok=True)
 
     # Query the API to generate the list of files
-    api_url = "https://oceandata.sci.gsfc.nasa.gov/api/file_search"
+    api_url = OB_DAAC_API
 
     payload = {
         "results_as_file": 1,
@@ -146,61 +511,72 @@ def download_l2_web(tspan_web, appkey, sensor_id=48, dtid=1546, \
         "edate": tspan_web[1],               # End date
         "appkey": appkey,                # API key
     }
+    if flag_checksum:
+        payload["cksum"] = 1             # lines become "<sha1>  <file_name>"
 
-    # POST request to get the file list
-    try:
-        response = requests.post(api_url, data=payload)
-        response.raise_for_status()  # Raise an error if the request failed
-        with open(filelist_name, "w") as file_list:
-            file_list.write(response.text)
-        print(f"✅ File list saved to {filelist_name}")
-    except requests.RequestException as e:
-        print(f"❌ Error in API request: {e}")
-        return []
-
-    # Read file names from the file list
-    with open(filelist_name, "r") as file_list:
-        file_names = [line.strip() for line in file_list.readlines()]
-
-    # Step 2: Process and download files
-    downloaded_files = []
-    for file_name in file_names:
-        output_file_path = os.path.join(output_folder, file_name)
+    session = create_session(nworkers)
+    policy = policy or retry_policy
 
-        # Check if the file already exists and is valid
-        if os.path.exists(output_file_path):
-            try:
-                subprocess.run(
-                    ["ncdump", "-h", output_file_path],
-                    check=True,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL
-                )
-                print(f"✅ File '{file_name}' already exists and is valid.")
-                continue
-            except subprocess.CalledProcessError:
-                print(f"⚠️ File '{file_name}' is invalid. Deleting and re-downloading.")
-                os.remove(output_file_path)
+    def post_file_search():
+        response = session.post(api_url, data=payload, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()  # Raise an error if the request failed
+        return response
 
-        # Download the file
+    # POST request to get the file list, unless the same query is in the search cache
+    search_product = f"file_search_{sensor_id}_{dtid}" + ("_cksum" if flag_checksum else "")
+    lines = search_cache_get(cache_path, search_product, tspan_web, ttl=search_ttl)
+    if lines is None:
         try:
-            download_url = f"https://oceandata.sci.gsfc.nasa.gov/cgi/getfile/{file_name}"
-            print(f"⬇️  Downloading: {file_name}")
-            response = requests.get(download_url, stream=True)
-            response.raise_for_status()  # Raise an error if the request failed
-            with open(output_file_path, "wb") as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    file.write(chunk)
-            print(f"✅ File downloaded: {file_name}")
-            downloaded_files.append(output_file_path)
+            response = policy.call(post_file_search, name="file_search")
         except requests.RequestException as e:
-            print(f"❌ Failed to download {file_name}: {e}")
+            print(f"❌ Error in API request: {e}")
+            return []
+        lines = response.text.splitlines()
+        search_cache_put(cache_path, search_product, tspan_web, lines)
+    with open(filelist_name, "w") as file_list:
+        file_list.write("\n".join(lines)+"\n")
+    print(f"✅ File list saved to {filelist_name}")
+
+    # Read file names (and checksums) from the file list
+    file_names, checksums = [], []
+    with open(filelist_name, "r") as file_list:
+        for line in file_list.readlines():
+            fields = line.split()
+            if len(fields) == 2:
+                checksums.append(fields[0])
+                file_names.append(fields[1])
+            elif len(fields) == 1:
+                checksums.append(None)
+                file_names.append(fields[0])
+
+    # Skip granules already processed (incremental mode)
+    if skip_timestamps:
+        keep = [extract_timestamp(file_name) not in skip_timestamps for file_name in file_names]
+        print(f"skip {keep.count(False)} granules already processed")
+        file_names = [file_name for file_name, flag in zip(file_names, keep) if flag]
+        checksums = [checksum for checksum, flag in zip(checksums, keep) if flag]
+
+    # Step 2: Process and download files, results keep the order of file_names
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(nworkers, 1)) as executor:
+        results = list(executor.map(lambda file_name, checksum: \
+                                    download_one_web(session, file_name, output_folder, \
+                                                     checksum=checksum, cache_path=cache_path, policy=policy),
+                                    file_names, checksums))
+    dt = time.perf_counter() - t0
+    session.close()
+
+    downloaded_files = [path for path, nbytes, seconds in results if path]
+    total_bytes = sum(nbytes for path, nbytes, seconds in results)
 
     print(f"✅ Total downloaded files: {len(downloaded_files)}")
+    print(f"✅ Total downloaded: {total_bytes/1e6:.1f} MB in {dt:.1f} s "
+          f"({total_bytes/1e6/max(dt, 1e-6):.1f} MB/s, nworkers={nworkers})")
     return downloaded_files
     
 
-def download_l1c_web(file1, l1c_path, sensor="PACE_HARP2", suite="L1C.V3.5km"):
+def download_l1c_web(file1, l1c_path, sensor="PACE_HARP2", suite="L1C.V3.5km", session=None, cache_path=None, \
+                     policy=None):
     """
     Retrieve Level 1C data file based on the timestamp extracted from a Level 2 file.
 
@@ -211,6 +587,12 @@ def download_l1c_web(file1, l1c_path, sensor="PACE_HARP2", suite="L1C.V3.5km"):
         Example: "PACE_HARP2.2025-09-20T12-00-00.L2.V3.nc"
     l1c_path : str
         The directory where the downloaded Level 1C file will be stored.
+    session : requests.Session, optional
+        Reuse an existing session, otherwise a new one is created for this call.
+    cache_path : str, optional
+        Granule cache shared across runs, disabled if None.
+    policy : RetryPolicy, optional
+        Retry/backoff for the transfer, default retry_policy.
 
     Returns:
     -------
@@ -231,22 +613,73 @@ def download_l1c_web(file1, l1c_path, sensor="PACE_HARP2", suite="L1C.V3.5km"):
     file_name = f"{sensor}.{timestamp3}.{suite}.nc"
     print(f"Constructed filename for Level 1C data: {file_name}")
 
-    # Download the file
+    # Download the file, files under the final name are always complete
     output_file_path = os.path.join(l1c_path, file_name)
     #downloaded_files = []
-    try:
-        download_url = f"https://oceandata.sci.gsfc.nasa.gov/cgi/getfile/{file_name}"
-        print(f"⬇️  Downloading: {file_name}")
-        response = requests.get(download_url, stream=True)
-        response.raise_for_status()  # Raise an error if the request failed
-        with open(output_file_path, "wb") as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
-        print(f"✅ File downloaded: {file_name}")
-        #downloaded_files.append(output_file_path)
-    except requests.RequestException as e:
-        print(f"❌ Failed to download {file_name}: {e}")
+    if os.path.exists(output_file_path) and check_netcdf_file(output_file_path):
+        print(f"✅ File '{file_name}' already exists and is valid.")
+    elif cache_fetch(cache_path, file_name, l1c_path) and check_netcdf_file(output_file_path):
+        pass
+    else:
+        try:
+            download_url = f"{OB_DAAC_GETFILE}{file_name}"
+            print(f"⬇️  Downloading: {file_name}")
+            nbytes, size = (policy or retry_policy).call(fetch_file, session or requests, download_url, output_file_path)
+            if check_netcdf_file(output_file_path, expected_size=size):
+                print(f"✅ File downloaded: {file_name}")
+                cache_store(cache_path, output_file_path)
+            else:
+                print(f"❌ Downloaded file {file_name} is not a valid netCDF file")
+                os.remove(output_file_path)
+            #downloaded_files.append(output_file_path)
+        except requests.RequestException as e:
+            print(f"❌ Failed to download {file_name}: {e}")
 
     # Find all .nc files in the l1c_path directory that match the timestamp
     filelist_l1c = list(Path(l1c_path).glob(f"*{timestamp3}*.nc"))
-    return filelist_l1c
\ No newline at end of file
+    return filelist_l1c
+
+def prefetch_l1c(filev2, l1c_path, flag_earthdata_cloud=True, sensor="PACE_HARP2", suite="L1C.V3.5km", \
+                 nprefetch=2, cache_path=None):
+    """
+    Download the matching L1C files of filev2 in a background thread, and yield
+    (file1, filelist_l1c) in the order of filev2 as soon as each one has landed.
+
+    At most nprefetch finished downloads wait in the queue (plus the one in flight),
+    so the caller can cap scratch disk usage by removing each L1C file once it is used.
+    """
+    results = queue.Queue(maxsize=max(nprefetch, 1))
+    stop = threading.Event()
+
+    def producer():
+        session = None if flag_earthdata_cloud else create_session()
+        for file1 in filev2:
+            if stop.is_set():
+                break
+            try:
+                if flag_earthdata_cloud:
+                    filelist_l1c = download_l1c_cloud(file1, l1c_path, sensor=sensor, suite=suite, \
+                                                      cache_path=cache_path)
+                else:
+                    filelist_l1c = download_l1c_web(file1, l1c_path, sensor=sensor, suite=suite, \
+                                                    session=session, cache_path=cache_path)
+            except Exception as e:
+                print(f"❌ Failed to prefetch L1C for {file1}: {e}")
+                filelist_l1c = []
+            #wait for room in the queue, unless the consumer has stopped
+            while not stop.is_set():
+                try:
+                    results.put((file1, filelist_l1c), timeout=1)
+                    break
+                except queue.Full:
+                    pass
+        if session:
+            session.close()
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        for _ in range(len(filev2)):
+            yield results.get()
+    finally:
+        stop.set()
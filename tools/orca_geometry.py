@@ -0,0 +1,76 @@
+"""
+Geometry of a granule swath, shared by the L1C rgb/dolp and all the L2 variables of plot_l1c_l2
+
+SwathGeometry holds, for one lon2/lat2 grid:
+- the map extent and projection (plot_crossdateline_extent)
+- the dateline split masks used by plot_crossdateline_rgb and plot_crossdateline_scalar
+
+It is built once per granule, in memory: it takes milliseconds, so it is not kept between runs.
+"""
+
+import numpy as np
+import cartopy.crs as ccrs
+
+def plot_crossdateline_extent(lon2, lat2):
+    """
+    Compute map extent that handles dateline-crossing correctly.
+
+    Parameters
+    ----------
+    lon2, lat2 : 2D numpy arrays
+        Longitude and latitude grids.
+
+    Returns
+    -------
+    extent : list
+        [lon_min, lon_max, lat_min, lat_max]
+    projection : ccrs.Projection
+        Recommended Cartopy projection.
+    flag_crossdateline : bool
+        Whether data crosses the dateline.
+    """
+    lon_flat = lon2.flatten()  # More explicit than concatenate
+    lat_flat = lat2.flatten()
+    lon_min, lon_max = lon_flat.min(), lon_flat.max()
+    lat_min, lat_max = lat_flat.min(), lat_flat.max()
+
+    flag_crossdateline = (lon_max - lon_min) > 180
+
+    if flag_crossdateline:
+        print("*************cross dateline detected")
+        # Convert longitudes to [-180, 180] range for proper extent calculation
+        lon_wrapped = np.where(lon_flat > 180, lon_flat - 360, lon_flat)
+        extent = [lon_wrapped.min(), lon_wrapped.max(), lat_min, lat_max]
+        projection = ccrs.PlateCarree(central_longitude=180)
+    else:
+        extent = [lon_min, lon_max, lat_min, lat_max]
+        projection = ccrs.PlateCarree()
+
+    return extent, projection, flag_crossdateline
+
+class SwathGeometry:
+    """
+    Geometry of one lon2/lat2 grid, computed once and shared by all the plots of the granule.
+
+    extent, projection, flag_crossdateline: map of the granule, see plot_crossdateline_extent
+    crosses: the first row of lon2 crosses the dateline, the swath is then drawn in two halves
+    lon2_wrapped: lon2 in [-180, 180]
+    rgb_hidden: pixels hidden in the west (0) and east (1) halves of the rgb, as in reset_lon
+    sides: (mask, lon, lat) of the east and west sides of the scalar plots, nan outside of the side
+    """
+
+    def __init__(self, lon2, lat2):
+        self.lon2, self.lat2 = lon2, lat2
+        self.extent, self.projection, self.flag_crossdateline = plot_crossdateline_extent(lon2, lat2)
+
+        lon1d = lon2[0, :]
+        self.crosses = (lon1d.max() - lon1d.min()) > 180
+        self.lon2_wrapped, self.rgb_hidden, self.sides = lon2, None, None
+        if self.crosses:
+            self.lon2_wrapped = np.where(lon2 > 180, lon2 - 360, lon2)
+            self.rgb_hidden = [(self.lon2_wrapped > 0) | (self.lon2_wrapped < -179), \
+                               (self.lon2_wrapped < 0) | (self.lon2_wrapped > 179)]
+            self.sides = []
+            for mask in [self.lon2_wrapped >= 0, self.lon2_wrapped < 0]:
+                if np.any(mask):
+                    self.sides.append((mask, np.where(mask, self.lon2_wrapped, np.nan), np.where(mask, lat2, np.nan)))
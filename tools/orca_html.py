@@ -58,9 +58,22 @@ def encode_image_to_base64(image_path, factor=1, output_format="JPEG", quality=8
         return None
 
 
-def get_images_from_subfolders(base_folder, valid_extensions=None):
+def image_mime(image_path, factor=1):
+    """
+    MIME subtype of the encoded image: jpeg when it is resized (re-encoded as JPEG),
+    otherwise from the file extension.
+    """
+    if factor > 1:
+        return "jpeg"
+    ext = os.path.splitext(image_path.lower())[1].lstrip(".")
+    return {"png": "png", "gif": "gif", "bmp": "bmp"}.get(ext, "jpeg")
+
+
+def get_images_from_subfolders(base_folder, valid_extensions=None, exclude=()):
     """
     Collect images from all subdirectories (timestamps).
+    exclude: subdirectories that are not timestamps, e.g. the full resolution exports of the
+    global map (the names of RENDER_PROFILES in orca_plot.py)
     """
     if valid_extensions is None:
         valid_extensions = {".png", ".jpg", ".jpeg"}
@@ -68,7 +81,7 @@ def get_images_from_subfolders(base_folder, valid_extensions=None):
     grouped_images = []
     for folder_name in sorted(os.listdir(base_folder)):
         folder_path = os.path.join(base_folder, folder_name)
-        if os.path.isdir(folder_path):
+        if os.path.isdir(folder_path) and folder_name not in exclude:
             images = [os.path.join(folder_path, img) for img in sorted(os.listdir(folder_path))
                       if is_valid_image(os.path.join(folder_path, img), valid_extensions)]
             if images:
@@ -165,7 +178,8 @@ def write_global_map_with_bboxes(
     # --- Base map ---
     if global_map:
         encoded_image = encode_image_to_base64(global_map, factor=resolution_factor, quality=quality)
-        map_tag = f"<img src='data:image/jpeg;base64,{encoded_image}' alt='Global Map' style='width:100%; display:block;'>"
+        mime = image_mime(global_map, resolution_factor)
+        map_tag = f"<img src='data:image/{mime};base64,{encoded_image}' alt='Global Map' style='width:100%; display:block;'>"
     else:
         map_url = "https://upload.wikimedia.org/wikipedia/commons/thumb/8/80/World_map_-_low_resolution.svg/1200px-World_map_-_low_resolution.svg.png"
         map_tag = f"<img src='{map_url}' alt='Global Map' style='width:100%; display:block;'>"
@@ -295,17 +309,8 @@ def generate_gallery_header(title, title2=None, logo_path=None, resolution_facto
         b64 = encode_image_to_base64(logo_path, factor=resolution_factor, quality=quality)
         if b64:
             include_logo = True
-            # Get file extension and determine MIME type
-            fname = os.path.basename(logo_path)
-            ext = fname.lower().split('.')[-1]
-            if ext == "png":
-                mime = "png"
-            elif ext == "gif":
-                mime = "gif"
-            elif ext == "bmp":
-                mime = "bmp"
-            else:
-                mime = "jpeg"
+            # MIME type of the encoded logo
+            mime = image_mime(logo_path, resolution_factor)
             logo_src = f'data:image/{mime};base64,{b64}'
             logo_html = f'<div class="header-logo"><img src="{logo_src}" alt="Logo"></div>'
     
@@ -431,13 +436,18 @@ def create_html_from_subfolders(image_groups, output_html, sequence, global_map=
                                 titlev=None, resolution_factor=1, quality=85, message1v=None, message2v=None,
                                 url_base="http://oceandata.sci.gsfc.nasa.gov/getfile/",
                                 sensor="PACE_HARP2", suite="L2.MAPOL_OCEAN.V3_0",
-                                hide_after_key='sph', infov_dict=None, text_box=None, logo_path=None):
+                                hide_after_key='sph', infov_dict=None, text_box=None, logo_path=None,
+                                logo_resolution_factor=2):
     """
     Create an HTML file grouping images by timestamp, with message boxes and a global map with clickable bounding boxes.
+
+    resolution_factor: downsampling of the plots (re-encoded as JPEG), 1 to embed the files as they are,
+    e.g. plots already saved at the preview resolution (see RENDER_PROFILES in orca_plot.py)
+    logo_resolution_factor: downsampling of the logo, independent of the plots
     """
     with open(output_html, "w") as f:
         # Write header with title, subtitle and logo
-        f.write(generate_gallery_header(title, title2, logo_path, resolution_factor, quality))
+        f.write(generate_gallery_header(title, title2, logo_path, logo_resolution_factor, quality))
         
         # Map
         if infov_dict:
@@ -790,13 +800,14 @@ def write_gallery_section(image_list, file_handle, sequence, titlev,
                 matched_image = next((img for img in filtered_images if f"_{col_key}." in img), None)
                 if matched_image:
                     encoded_image = encode_image_to_base64(matched_image, factor=resolution_factor, quality=quality)
+                    mime = image_mime(matched_image, resolution_factor)
                     caption = titlev[row_idx][col_idx] if titlev and len(titlev) > row_idx and len(titlev[row_idx]) > col_idx and titlev[row_idx][col_idx] else ""
                     image_id = f"img_{section_id}_{row_idx}_{col_idx}"
                     
                     # Make the image clickable - now passes section_id and image_counter within section
                     file_handle.write(f"""
                     <div class='img-container'>
-                        <img id="{image_id}" src='data:image/jpeg;base64,{encoded_image}' 
+                        <img id="{image_id}" src='data:image/{mime};base64,{encoded_image}' 
                              alt='{caption}' onclick="openImageModal(this.src, '{caption}', {section_id}, {image_counter})">
                         <div class='caption'>{caption}</div>
                     </div>
@@ -806,7 +817,7 @@ def write_gallery_section(image_list, file_handle, sequence, titlev,
                     file_handle.write(f"""
                     <script>
                     imageGalleries[{section_id}].push({{
-                        src: 'data:image/jpeg;base64,{encoded_image}',
+                        src: 'data:image/{mime};base64,{encoded_image}',
                         caption: '{caption}'
                     }});
                     </script>
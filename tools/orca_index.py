@@ -0,0 +1,208 @@
+"""
+Granule summary index (SQLite) for event selection without reading the L2 files again
+
+One row per (L2 file, iwv550, criteria), with the number of valid pixels, the histogram
+of aot at iwv550 (AOD_BIN wide bins, last bin open ended) over the pixels passing
+criteria, the bounding box, center and mean retrieval values of the granule.
+
+select_data answers npixel_valid0/npixel_valid1 from the index for any aod_min on the
+AOD_BIN grid (0.15, 0.2, 0.3, ...), the netCDF file is only read for granules not in the
+index yet, or changed since (size, mtime).
+"""
+
+import os
+import json
+import time
+import sqlite3
+import numpy as np
+
+from tools.orca_data import as_l2_granule
+
+AOD_BIN = 0.01
+
+def connect_index(index_path):
+    """
+    Open (and create) the index, several jobs may share it
+    """
+    folder = os.path.dirname(os.path.abspath(index_path))
+    os.makedirs(folder, exist_ok=True)
+    conn = sqlite3.connect(index_path, timeout=60)
+    conn.execute("""CREATE TABLE IF NOT EXISTS granule (
+                    file TEXT, timestamp TEXT, size INTEGER, mtime_ns INTEGER,
+                    iwv550 INTEGER, criteria TEXT, npixel_valid0 INTEGER, aod_hist TEXT,
+                    boundingbox TEXT, center TEXT, mean TEXT, time REAL,
+                    PRIMARY KEY (file, iwv550, criteria))""")
+    return conn
+
+def aod_edges(n, dtype=np.float64):
+    """lower edges of the first n aot bins, in the dtype aot is compared in"""
+    edges = np.round(np.arange(n)*AOD_BIN, 2)
+    if np.issubdtype(dtype, np.floating):
+        edges = edges.astype(dtype)
+    return edges
+
+def granule_footprint(granule):
+    """
+    (boundingbox, center) of the granule from the corners of its L2 latitude/longitude,
+    boundingbox: [lats, lons] of the closed corner polygon, (None, None) without latitude/longitude
+    """
+    try:
+        lat, lon = granule.get("latitude"), granule.get("longitude")
+        lons = [lon[0,0], lon[0,-1], lon[-1,-1], lon[-1,0], lon[0,0]]
+        lats = [lat[0,0], lat[0,-1], lat[-1,-1], lat[-1,0], lat[0,0]]
+        boundingbox = [[float(x) for x in lats], [float(x) for x in lons]]
+        center = [float(np.nanmin(lat)+np.nanmax(lat))/2, float(np.nanmin(lon)+np.nanmax(lon))/2]
+    except Exception as e:
+        print(f"⚠️ No latitude/longitude in {granule}: {e}")
+        boundingbox, center = None, None
+    return boundingbox, center
+
+def summarize_granule(granule, iwv550=1, criteria=(30, 20, 2.0)):
+    """
+    Summary of one granule, from the variables already read by select_data
+    """
+    aot550 = granule.get("aot", iwv550)
+    npixel_valid0 = int(np.sum(~np.isnan(aot550)))
+    mask = granule.criteria_mask(criteria) & ~np.isnan(aot550)
+
+    #histogram of aot, with pixels counted as in filter: aot >= bin edge
+    values = np.sort(aot550[mask])
+    nbin = int(np.floor(values[-1]/AOD_BIN))+2 if values.size else 0
+    count_ge = values.size - np.searchsorted(values, aod_edges(nbin, values.dtype), side="left")
+    aod_hist = np.diff(-count_ge, append=0)
+
+    boundingbox, center = granule_footprint(granule)
+
+    mean = {"aot": float(np.mean(aot550[mask])) if mask.any() else None}
+    for key in ["chi2", "nv_ref", "nv_dolp"]:
+        try:
+            mean[key] = float(np.nanmean(granule.get(key)[mask])) if mask.any() else None
+        except KeyError:
+            pass
+
+    return {"npixel_valid0": npixel_valid0, "aod_hist": aod_hist.tolist(), \
+            "boundingbox": boundingbox, "center": center, "mean": mean}
+
+def index_store(index_path, granule, summary, iwv550=1, criteria=(30, 20, 2.0)):
+    """
+    Add or replace the summary of one granule
+    """
+    stat = os.stat(granule)
+    with connect_index(index_path) as conn:
+        conn.execute("INSERT OR REPLACE INTO granule VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", \
+                     (os.path.basename(granule), granule.timestamp, stat.st_size, stat.st_mtime_ns, \
+                      iwv550, json.dumps(list(criteria)), summary["npixel_valid0"], json.dumps(summary["aod_hist"]), \
+                      json.dumps(summary["boundingbox"]), json.dumps(summary["center"]), \
+                      json.dumps(summary["mean"]), time.time()))
+    conn.close()
+
+def row_to_summary(row):
+    file_name, timestamp3, size, mtime_ns, iwv550, criteria, npixel_valid0, aod_hist, boundingbox, center, mean, _ = row
+    return {"file": file_name, "timestamp": timestamp3, "size": size, "mtime_ns": mtime_ns, \
+            "iwv550": iwv550, "criteria": json.loads(criteria), "npixel_valid0": npixel_valid0, \
+            "aod_hist": json.loads(aod_hist), "boundingbox": json.loads(boundingbox), \
+            "center": json.loads(center), "mean": json.loads(mean)}
+
+def index_lookup(index_path, file1, iwv550=1, criteria=(30, 20, 2.0)):
+    """
+    Summary of the granule, or None if not indexed or the file changed since
+    """
+    if not index_path or not os.path.exists(index_path):
+        return None
+    try:
+        stat = os.stat(file1)
+    except OSError:
+        return None
+    with connect_index(index_path) as conn:
+        row = conn.execute("SELECT * FROM granule WHERE file=? AND iwv550=? AND criteria=?", \
+                           (os.path.basename(file1), iwv550, json.dumps(list(criteria)))).fetchone()
+    conn.close()
+    if row is None:
+        return None
+    summary = row_to_summary(row)
+    if summary["size"] != stat.st_size or summary["mtime_ns"] != stat.st_mtime_ns:
+        return None
+    return summary
+
+def summary_counts(summary, aod_min):
+    """
+    (npixel_valid0, npixel_valid1) as filter_data would return them,
+    None if aod_min is not a bin edge
+    """
+    if aod_min is None:
+        return None
+    k = int(round(aod_min/AOD_BIN))
+    if k < 0 or np.round(k*AOD_BIN, 2) != aod_min:
+        return None
+    return summary["npixel_valid0"], int(sum(summary["aod_hist"][k:]))
+
+def ingest_granules(index_path, filelist_l2, iwv550=1, criteria=(30, 20, 2.0)):
+    """
+    Index the granules of filelist_l2 not indexed yet, returns the number of new entries
+    """
+    nnew = 0
+    for file1 in filelist_l2:
+        if index_lookup(index_path, file1, iwv550, criteria) is not None:
+            continue
+        granule = as_l2_granule(file1)
+        try:
+            index_store(index_path, granule, summarize_granule(granule, iwv550, criteria), iwv550, criteria)
+            nnew += 1
+        finally:
+            if granule is not file1:
+                granule.close()
+    print(f"✅ Index {index_path}: {nnew} granules added")
+    return nnew
+
+def query_index(index_path, aod_min=0.3, npixel_min=100*100, iwv550=1, criteria=(30, 20, 2.0)):
+    """
+    Summaries of all indexed granules with at least npixel_min pixels passing aod_min and criteria
+    """
+    with connect_index(index_path) as conn:
+        rows = conn.execute("SELECT * FROM granule WHERE iwv550=? AND criteria=? ORDER BY timestamp", \
+                            (iwv550, json.dumps(list(criteria)))).fetchall()
+    conn.close()
+    selected = []
+    for summary in map(row_to_summary, rows):
+        counts = summary_counts(summary, aod_min)
+        if counts is not None and counts[1] >= npixel_min:
+            summary["npixel_valid1"] = counts[1]
+            selected.append(summary)
+    return selected
+
+def select_data(filelist_l2, aod_min = 0.3, npixel_min = 100*100, iwv550=1, criteria = (30, 20, 2.0), \
+                index_path=None):
+    """
+    select data based on aod_min and min npixel
+    filelist_l2 can be any iterable, e.g. download_l2_cloud(..., flag_stream=True),
+    so selection starts while later granules are still downloading
+
+    returns the selected files as L2Granule objects, still open with their data and
+    filter mask, to be reused by make_plot; rejected granules are closed here
+
+    index_path: granule summary index, granules already indexed
+    are selected without reading the file, the others are read and added to the index
+    """
+    filev2 =[]
+    for file1 in filelist_l2:
+        #print(file1)
+        granule = as_l2_granule(file1)
+
+        summary = index_lookup(index_path, granule, iwv550=iwv550, criteria=criteria)
+        counts = summary_counts(summary, aod_min) if summary else None
+        if counts:
+            npixel_valid0, npixel_valid1 = counts
+            print('index:', granule.timestamp)
+        else:
+            npixel_valid0, npixel_valid1,filter1 = granule.filter(iwv550=iwv550, aot_min = aod_min, criteria =criteria)
+            if index_path and summary is None:
+                index_store(index_path, granule, summarize_granule(granule, iwv550=iwv550, criteria=criteria), \
+                            iwv550=iwv550, criteria=criteria)
+        print('=====non-nan, filtered:', npixel_valid0, npixel_valid1)
+        if npixel_valid1 >=npixel_min:
+            print(granule)
+            filev2.append(granule)
+            print(' *** found: non-nan, filtered:', npixel_valid0, npixel_valid1)
+        else:
+            granule.close()
+    return filev2
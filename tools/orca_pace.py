@@ -5,9 +5,6 @@ import glob
 import shutil
 from urllib.parse import urlparse
 from io import StringIO
-import pandas as pd
-import earthaccess
-from matplotlib import rcParams
 from datetime import datetime, timedelta
 from tools.orca_utility import setup_data
 from tools.orca_download import download_l2_cloud, download_l2_web
@@ -44,6 +41,61 @@ def get_pace_data_info(product):
         
     return outputfile_header, product_info_nrt, product_info_refined
 
+def get_product_settings(product):
+    """
+    selection and plot settings of a product, shared by orca_run.py and orca_detect.py
+
+    aod_min, aod_min_plot, npixel_min: defaults of the selection and of the plotted/statistics pixels
+    iv, iwvv, ivp, iwvvp: L1C rgb (and dolp) angle and wavelength indexes
+    iwv550: wavelength index of aot for aod_min, iwv_aod/iwv_rrs: wavelength index of the plotted variables
+    """
+    if(product=='harp2_fastmapol'):
+        #100*100 early version
+        #100*20 may be too less
+        settings = {'outputfile_header': 'harp2_fastmapol_', \
+                    'aod_min': 0.3, 'aod_min_plot': 0.3, 'npixel_min': 100*40, \
+                    'iv': [40, 5, 85], 'iwvv': 0, 'ivp': [40, 5, 85], 'iwvvp': 0, #nadir rgb
+                    'iwv550': 1, 'iwv_aod': 1, 'iwv_rrs': 0, 'criteria': (30, 30, 2.0), 'nv_max': 90}
+    elif(product=='spexone_fastmapol'):
+        #668.4302, 548.3369, 437.2723 for the l1c rgb, 550 for aod_min and aod, 440 for rrs
+        settings = {'outputfile_header': 'spexone_fastmapol_', \
+                    'aod_min': 0.2, 'aod_min_plot': 0.2, 'npixel_min': 100*4, \
+                    'iv': 2, 'iwvv': [290, 170, 60], 'ivp': 2, 'iwvvp': [39, 25, 9], \
+                    'iwv550': 21, 'iwv_aod': 21, 'iwv_rrs': 5, 'criteria': (140, 140, 2.0), 'nv_max': 170}
+    elif(product=='spexone_remotap'):
+        settings = {'outputfile_header': 'spexone_remotap_', \
+                    'aod_min': 0.2, 'aod_min_plot': 0.2, 'npixel_min': 100*4, \
+                    'iv': 2, 'iwvv': [290, 170, 60], 'ivp': 2, 'iwvvp': [39, 25, 9], \
+                    'iwv550': 7, 'iwv_aod': 7, 'iwv_rrs': 3, 'criteria': (None, None, 5.0), 'nv_max': 170}
+    else:
+        print(product, "not available")
+        settings = None
+    return settings
+
+def get_variable_settings(nv_max=90):
+    """
+    L2 variables plotted (and summarized) with their [vmin, vmax], colormap and scale
+
+    Returns:
+    -------
+    key1v, vmin1v, vmax1v, cmap1v, scale1v
+    """
+    dict1v= {'aot':[[0, 1],'YlOrRd','linear'] , \
+             'ssa':[[0.7, 1], 'jet','linear'], 'fvf':[[0, 1], 'jet','linear'], 'sph':[[0,1], 'jet','linear'], \
+             'aot_fine':[[0,1], 'YlOrRd','linear'], 'aot_coarse':[[0,1], 'YlOrRd','linear'], 'angstrom_440_670':[[-1,2], 'jet','linear'], \
+             'alh':[[0,6], 'jet','linear'], 'mr':[[1.3,1.65], 'jet','linear'], 'mi':[[0,0.03], 'jet','linear'], \
+              'wind_speed': [[0, 10], 'jet','linear'], 'chla':[[-2,1], 'jet','log10'],\
+              'Rrs2_mean':[[0,0.02], 'jet','linear'], 'Rrs2_std':[[0,0.02], 'jet','linear'],\
+              'chi2':[[0,5], 'jet','linear'], 'nv_ref':[[0,nv_max], 'jet','linear'], \
+              'nv_dolp':[[0,nv_max], 'jet','linear'],'quality_flag':[[0,5], 'jet','linear']}
+
+    key1v = list(dict1v.keys())
+    vmin1v = [dict1v[key][0][0] for key in key1v]
+    vmax1v = [dict1v[key][0][1] for key in key1v]
+    cmap1v = [dict1v[key][1] for key in key1v]
+    scale1v = [dict1v[key][2] for key in key1v]
+    return key1v, vmin1v, vmax1v, cmap1v, scale1v
+
 def download_pace_data(tspan, product, appkey, api_key, path1='./pace_tmp/', \
                        flag_earthdata_cloud = False):
     #setup_data(tspan, sensor='PACE_HARP2', suite='MAPOL_OCEAN.V3.0', path1='./pace_tmp/')
@@ -51,10 +103,12 @@ def download_pace_data(tspan, product, appkey, api_key, path1='./pace_tmp/', \
     outputfile_header, product_info_nrt, product_info_refined = get_pace_data_info(product)
     
     if(flag_earthdata_cloud):
+        import earthaccess
         auth = earthaccess.login(persist=True)
     
         
     # Change default font to something available
+    from matplotlib import rcParams
     rcParams['font.family'] = 'serif' 
     rcParams['font.size'] = '12' 
     
@@ -16,6 +16,8 @@ To do:
 import os
 import glob
 import pickle
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
 import xarray as xr
 from pathlib import Path
@@ -31,7 +33,60 @@ from cartopy.util import add_cyclic_point
 
 from tools.orca_download import *
 from tools.orca_utility import *
-from tools.orca_data import extract_timestamp, filter_data
+from tools.orca_data import extract_timestamp, filter_data, as_l2_granule, read_l1c_rgb
+from tools.orca_index import select_data
+from tools.orca_geometry import SwathGeometry, plot_crossdateline_extent
+from tools.orca_cache import plot_fingerprint, plot_cache_get, plot_cache_put
+from tools.orca_stats import granule_statistics, granule_variable
+
+#how the figures are saved: scale of the dpi of each figure (400 for the maps, 300 for the bounding boxes),
+#format and jpeg quality. preview is what the html pages show, full the full resolution export.
+RENDER_PROFILES = {
+    "full": {"scale": 1.0, "format": "png"},
+    "preview": {"scale": 0.5, "format": "jpg", "quality": 75},
+}
+
+#parameters of plot_l1c_l2 changing the plots or the info, part of the plot fingerprint
+PLOT_PARAMS = ["iv", "ivp", "iwvv", "iwvvp", "iwv_aod", "iwv_rrs", "key1v", "vmin1v", "vmax1v", "cmap1v", "scale1v", \
+               "aod_min_plot", "sensor", "suite1", "suite2", "criteria", "flag_plot_filter", "render_profiles"]
+
+def plot_cache_lookup(file1, plot_path, params):
+    """
+    info of the granule if its plots in plot_path were made from the same file with the same
+    parameters (PLOT_PARAMS of params), otherwise None
+    """
+    timestamp3 = extract_timestamp(file1)
+    try:
+        fingerprint = plot_fingerprint(file1, {key: params[key] for key in PLOT_PARAMS})
+    except OSError:
+        return None
+    return plot_cache_get(os.path.join(plot_path, timestamp3), fingerprint)
+
+def render_fileouts(fileout, render_profiles=("full",)):
+    """
+    [(profile, file)] of fileout for each render profile, with the extension of its format.
+    The first profile is saved next to fileout, the others in a subfolder named after the profile.
+    """
+    root = os.path.splitext(fileout)[0]
+    fileouts = []
+    for i, profile in enumerate(render_profiles):
+        if i > 0:
+            root = os.path.join(os.path.dirname(fileout), profile, os.path.basename(root))
+        fileouts.append((profile, root+"."+RENDER_PROFILES[profile]["format"]))
+    return fileouts
+
+def save_figure(fig, fileout, dpi=400, render_profiles=("full",)):
+    """
+    save fig once per render profile, directly at the size and in the format of the profile,
+    returns the files written
+    """
+    fileouts = render_fileouts(fileout, render_profiles)
+    for profile, file1 in fileouts:
+        setting = RENDER_PROFILES[profile]
+        os.makedirs(os.path.dirname(file1) or ".", exist_ok=True)
+        kwargs = {"pil_kwargs": {"quality": setting["quality"]}} if "quality" in setting else {}
+        fig.savefig(file1, dpi=dpi*setting["scale"], bbox_inches='tight', pad_inches=0.1, **kwargs)
+    return [file1 for _, file1 in fileouts]
 
 def make_plot(filev2, plot_path, l1c_path="./data/", \
               flag_earthdata_cloud=True,\
@@ -44,50 +99,111 @@ def make_plot(filev2, plot_path, l1c_path="./data/", \
               vmax1v = [1, 1, 1, 1],
               cmap1v = ['YlOrRd', 'jet', 'jet', 'jet'],
               scale1v = ['linear', 'linear', 'linear', 'linear'],
-              flag_plot_filter=False
+              flag_plot_filter=False, cache_path=None, nprefetch=0, flag_rm_l1c=False, nworkers=1, \
+              render_profiles=("full",), flag_replot=False
              ):
     """generate plots according to filev2
 
     after data selection, we will only plot the data within aod_min_plot, and criteria, 
     aerosol statistics are also computed within this range to ensure quality
     aod will be plot over all available range. 
+
+    cache_path: granule cache for the l1c files, see tools/orca_cache.py
+    nprefetch: if >0, download the l1c files in the background, up to nprefetch ahead of plotting
+    flag_rm_l1c: remove each l1c file after its plots are made, to cap scratch disk usage
+    filev2: L2 files or the L2Granule objects from select_data, each granule is closed after its plots
+    nworkers: if >1, plot the granules in a pool of nworkers processes, infov keeps the order of filev2
+    render_profiles: profiles the plots are saved in (RENDER_PROFILES), e.g. ("preview", "full") for the
+    html previews next to the plots and the full resolution png in a full/ subfolder
+    flag_replot: plot all granules, otherwise granules already plotted in plot_path from the same file
+    with the same parameters are skipped (no l1c download), and their info is read from the plot folder
     """
     
     os.makedirs(plot_path, exist_ok=True)
     os.makedirs(l1c_path, exist_ok=True)
 
+    kwargs = dict(iwvv=iwvv,iv=iv, iwvvp=iwvvp,ivp=ivp, iwv_aod=iwv_aod, iwv_rrs=iwv_rrs,\
+                  l1c_path=l1c_path, flag_earthdata_cloud=flag_earthdata_cloud, aod_min_plot=aod_min_plot,\
+                  sensor=sensor, suite1=suite1, suite2=suite2, criteria=criteria,\
+                  key1v=key1v, vmin1v=vmin1v, vmax1v=vmax1v, cmap1v=cmap1v,scale1v=scale1v,\
+                  flag_plot_filter=flag_plot_filter, cache_path=cache_path,\
+                  render_profiles=render_profiles, flag_replot=flag_replot)
+
+    #granules with up to date plots
+    infov_cached = {}
+    if not flag_replot:
+        for file1 in filev2:
+            info = plot_cache_lookup(file1, plot_path, kwargs)
+            if info is not None:
+                print(f"✅ Plots of {extract_timestamp(file1)} up to date, not plotted again")
+                infov_cached[os.fspath(file1)] = info
+    filev2_all = filev2
+    filev2 = [file1 for file1 in filev2 if os.fspath(file1) not in infov_cached]
+
+    pool = None
+    if nworkers > 1 and len(filev2) > 1:
+        #workers open the files again by path, no hdf5 file may be open when they are forked
+        for file1 in filev2:
+            if hasattr(file1, 'close'):
+                file1.close()
+        #fork all workers now, before the prefetch thread starts
+        pool = ProcessPoolExecutor(max_workers=min(nworkers, len(filev2)), mp_context=mp.get_context("fork"))
+        pool.submit(os.getpid).result()
+
+    if nprefetch > 0:
+        l1c_iter = prefetch_l1c(filev2, l1c_path, flag_earthdata_cloud=flag_earthdata_cloud, \
+                                sensor=sensor, suite=suite1, nprefetch=nprefetch, cache_path=cache_path)
+    else:
+        #download each l1c right before its plots
+        l1c_iter = ((file1, None) for file1 in filev2)
+
+    def finish(file1):
+        if hasattr(file1, 'close'):
+            file1.close()
+        if flag_rm_l1c:
+            for file4 in glob.glob(os.path.join(l1c_path, '*'+extract_timestamp(file1)+'*.nc')):
+                os.remove(file4)
+
     infov = []
-    for file1 in filev2[:]:
-        #try:
-        info = plot_l1c_l2(file1, plot_path, iwvv=iwvv,iv=iv, iwvvp=iwvvp,ivp=ivp, iwv_aod=iwv_aod, iwv_rrs=iwv_rrs,\
-                l1c_path=l1c_path, flag_earthdata_cloud=flag_earthdata_cloud, aod_min_plot=aod_min_plot,\
-                sensor=sensor, suite1=suite1, suite2=suite2, criteria=criteria,\
-                key1v=key1v, vmin1v=vmin1v, vmax1v=vmax1v, cmap1v=cmap1v,scale1v=scale1v,\
-                           flag_plot_filter=flag_plot_filter)
-        infov.append(info)
-        #except:
-        #    print('failed to make plot', file1)
+    if pool is None:
+        for file1, filelist_l1c in l1c_iter:
+            #try:
+            info = plot_l1c_l2(file1, plot_path, filelist_l1c=filelist_l1c, **kwargs)
+            infov.append(info)
+            #except:
+            #    print('failed to make plot', file1)
+            finish(file1)
+    else:
+        #at most nworkers+nprefetch granules in flight, so the l1c files on disk stay bounded
+        futures, running = [], {}
+        with pool:
+            for file1, filelist_l1c in l1c_iter:
+                if len(running) >= nworkers + max(nprefetch, 1):
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(running.pop(future))
+                future = pool.submit(plot_l1c_l2, os.fspath(file1), plot_path, filelist_l1c=filelist_l1c, **kwargs)
+                futures.append(future)
+                running[future] = file1
+            for future in futures:
+                infov.append(future.result())
+            for file1 in running.values():
+                finish(file1)
+
+    #back in the order of filev2, with the info of the granules not plotted again
+    infov_new = iter(infov)
+    infov = []
+    for file1 in filev2_all:
+        if os.fspath(file1) in infov_cached:
+            infov.append(infov_cached[os.fspath(file1)])
+            if hasattr(file1, 'close'):
+                file1.close()
+        else:
+            infov.append(next(infov_new))
     #create a dictionary
     infov_dict = create_dict_by_timestamp(infov)
     return infov, infov_dict
 
-def select_data(filelist_l2, aod_min = 0.3, npixel_min = 100*100, iwv550=1, criteria = (30, 20, 2.0)):
-    """
-    select data based on aod_min and min npixel
-    """
-    filev2 =[]
-    for i1 in range(len(filelist_l2)):
-        file1 = filelist_l2[i1]
-        #print(file1)
-    
-        npixel_valid0, npixel_valid1,filter1 = filter_data(file1, iwv550=iwv550, aot_min = aod_min, criteria =criteria)
-        print('=====non-nan, filtered:', npixel_valid0, npixel_valid1)
-        if npixel_valid1 >=npixel_min:
-            print(file1)
-            filev2.append(file1)
-            print(' *** found: non-nan, filtered:', npixel_valid0, npixel_valid1)
-    return filev2
-
 def create_dict_by_timestamp(infov):
     """
     Convert a list of dictionaries into a single dictionary with timestamps as keys.
@@ -111,10 +227,11 @@ def plot_l1c_l2(file1, plot_path, \
                 aod_min_plot = None,
                 sensor="PACE_HARP2",suite1="L1C",suite2="L2",
                 criteria = (30, 20, 2.0),
-                flag_plot_filter=False
+                flag_plot_filter=False, cache_path=None, filelist_l1c=None,
+                render_profiles=("full",), flag_replot=False
                 ):
     """
-    file1: L2 data file
+    file1: L2 data file or L2Granule (the file is then not opened again)
     plot_path: where is the images
     iv: harp2 rgb angles
     lc_folder: where to save
@@ -134,6 +251,10 @@ def plot_l1c_l2(file1, plot_path, \
     if scale=log10, will plot in log10 scale
     flag_plot_filter: true, plot filtered data, false: plot all
     info are still based on filtered information for targeted event
+    cache_path: granule cache for the l1c file, disabled if None
+    filelist_l1c: l1c files already downloaded (e.g. by prefetch_l1c), otherwise download here
+    render_profiles: resolution/format of the saved plots, see RENDER_PROFILES
+    flag_replot: plot even if the plots of the granule are up to date (see plot_cache_lookup)
     
     """
     ########## get l2 data ########################
@@ -147,47 +268,50 @@ def plot_l1c_l2(file1, plot_path, \
     info['timestamp']=timestamp3
     
     print(timestamp3)
+
+    #plots already made from the same file with the same parameters
+    params = dict(iv=iv, ivp=ivp, iwvv=iwvv, iwvvp=iwvvp, iwv_aod=iwv_aod, iwv_rrs=iwv_rrs, \
+                  key1v=key1v, vmin1v=vmin1v, vmax1v=vmax1v, cmap1v=cmap1v, scale1v=scale1v, \
+                  aod_min_plot=aod_min_plot, sensor=sensor, suite1=suite1, suite2=suite2, criteria=criteria, \
+                  flag_plot_filter=flag_plot_filter, render_profiles=render_profiles)
+    if not flag_replot:
+        info_cached = plot_cache_lookup(file1, plot_path, params)
+        if info_cached is not None:
+            print(f"✅ Plots of {timestamp3} up to date, not plotted again")
+            return info_cached
     
-    datatree = xr.open_datatree(file1)
-    dataset2 = xr.merge(datatree.to_dict().values())
+    granule = as_l2_granule(file1)
 
     ########### get l1 data #######################
-    if(flag_earthdata_cloud):
-        #
-        filelist_l1c = download_l1c_cloud(file1, l1c_path, sensor=sensor, suite=suite1)
-    else:
-        #sensor="PACE_HARP2", split=".L2",suite1="L1C.V3.5km"
-        filelist_l1c = download_l1c_web(file1, l1c_path, sensor=sensor, suite=suite1)
+    if filelist_l1c is None:
+        if(flag_earthdata_cloud):
+            #
+            filelist_l1c = download_l1c_cloud(file1, l1c_path, sensor=sensor, suite=suite1, cache_path=cache_path)
+        else:
+            #sensor="PACE_HARP2", split=".L2",suite1="L1C.V3.5km"
+            filelist_l1c = download_l1c_web(file1, l1c_path, sensor=sensor, suite=suite1, cache_path=cache_path)
     
     file4 = filelist_l1c[0]
     print(file4)
-    datatree = xr.open_datatree(file4)
-    dataset1 = xr.merge(datatree.to_dict().values())
     #############################
 
-    #get lat, lon, and radiance
-    lon2=dataset1['longitude'].values
-    lat2=dataset1['latitude'].values
+    #get lat, lon, and radiance, only the rgb angles/bands are read
+    lon2, lat2, tmp2i, tmp2dolp = read_l1c_rgb(file4, iv=iv, iwvv=iwvv, ivp=ivp, iwvvp=iwvvp)
 
-    if (iv is not None) and (iwvv is not None):
-        tmp2i = dataset1.i[:, :, iv, iwvv].values
-    else:
-        tmp2i = np.full_like(lon2, None, dtype=object)
-    
-    if (ivp is not None) and (iwvvp is not None):
-        tmp2dolp = dataset1.dolp[:, :, ivp, iwvvp].values
-    else:
-        tmp2dolp = np.full_like(lon2, None, dtype=object)
+    #extent and dateline masks, shared by the rgb, dolp and all l2 variables
+    geometry = SwathGeometry(lon2, lat2)
     
     #set output path
     plot_path2 = plot_path+'/'+timestamp3+'/'
     os.makedirs(plot_path2, exist_ok=True)
     print(plot_path2)
+    fileouts = []
 
     #plot bounding box
     fileout= plot_path2+'pace_harp2'+'_'+timestamp3+'_globe.png'
     print(fileout)
-    boundingbox, center = plot_bounding_box_one(lat2, lon2, timestamp3, fileout=fileout)
+    boundingbox, center = plot_bounding_box_one(lat2, lon2, timestamp3, fileout=fileout, render_profiles=render_profiles)
+    fileouts.append(fileout)
     
     info['boundingbox'] = boundingbox
     info['center'] = center
@@ -195,12 +319,12 @@ def plot_l1c_l2(file1, plot_path, \
     #with open("tmp2i.pk", "wb") as f:
     #    pickle.dump([lat2, lon2, tmp2i], f)
     
-    #plot l1 rgb
+    #plot l1 rgb, the l2 variables are added as layers over the same base map below
     title = f"{sensor} {suite2}+@{timestamp3}"
     fileout= plot_path2+sensor+suite2+'_'+timestamp3+'_rgb.png'
     print(fileout)
-    plot_rgb(lon2, lat2, tmp2i, None, figsize = (10, 5),\
-            title=title, fileout=fileout,)
+    layers = [dict(tmp3=None, title=title, fileout=fileout)]
+    fileouts.append(fileout)
 
     #plot l1 rgb in dolp
     title = f"{sensor} {suite2}+@{timestamp3}"
@@ -208,42 +332,32 @@ def plot_l1c_l2(file1, plot_path, \
     print(fileout)
     
     plot_rgb(lon2, lat2, tmp2dolp, None, flag_dolp=True, figsize = (10, 5),\
-            title=title, fileout=fileout,)
+            title=title, fileout=fileout, geometry=geometry, \
+            render_profiles=render_profiles)
+    fileouts.append(fileout)
 
     #plot l2 data
     #file1: l2 data file, aod_min_plot for data selection
 
     
-    npixel_valid0, npixel_valid1,filter1 = filter_data(file1, iwv550=iwv_aod, aot_min=aod_min_plot, criteria=criteria)
+    npixel_valid0, npixel_valid1,filter1 = granule.filter(iwv550=iwv_aod, aot_min=aod_min_plot, criteria=criteria)
 
+    ##only for aerosol statistics, all variables at once over the filtered pixels (see tools/orca_stats.py)
+    if(aod_min_plot):
+        stats = granule_statistics(granule, key1v, filter1, iwv_aod=iwv_aod, iwv_rrs=iwv_rrs, scale1v=scale1v, \
+                                   ranges=list(zip(vmin1v, vmax1v)))
+        if('aot' in stats):
+            #add total number of valid pixels in
+            info['pixel'] = stats['aot']['count']
+        for key1, stat in stats.items():
+            #includ the information in info
+            info[key1] = [stat['mean'], stat['std']]
+        info['stats'] = stats
     
     for i1, key1 in enumerate(key1v):
         try:
-            if('rrs' in key1.lower()):
-                iwv_plot=iwv_rrs
-            else:
-                iwv_plot=iwv_aod
-    
-            try:
-                tmp3 = dataset2[key1].values[:,:, iwv_plot]
-            except:
-                tmp3 = dataset2[key1].values[:,:]
-    
-            if(scale1v[i1]=='log10'):
-                #plot in log scale
-                tmp3=np.log10(tmp3)
-            
-            ##only for aerosol statistics
-            if(aod_min_plot):
-                #check all the data including aot
-                tmp4 = np.where(filter1, tmp3, np.nan).copy()
-    
-                if(key1=='aot'):
-                    #add total number of valid pixels in
-                    info['pixel']= np.sum(~np.isnan(tmp4))
-                    
-                #includ the information in info   
-                info[key1]=[np.nanmean(tmp4),np.nanstd(tmp4)]
+            #in log scale if scale1v[i1]=='log10'
+            tmp3 = granule_variable(granule, key1, iwv_aod=iwv_aod, iwv_rrs=iwv_rrs, scale1=scale1v[i1])
     
             #title = 'PACE HARP2 FastMAPOL L2 @'+ timestamp3
             #cbar_label = key1
@@ -285,11 +399,23 @@ def plot_l1c_l2(file1, plot_path, \
                 else:
                     vmin2, vmax2 = vmin1v[i1], vmax1v[i1]
                 
-            plot_rgb(lon2, lat2, tmp2i, tmp3, figsize = (10, 5), \
-                     vmin1=vmin2, vmax1=vmax2 , cmap=cmap1v[i1], \
-                     title=title, fileout=fileout, cbar_label=cbar_label)
+            layers.append(dict(tmp3=tmp3, vmin1=vmin2, vmax1=vmax2 , cmap=cmap1v[i1], \
+                               title=title, fileout=fileout, cbar_label=cbar_label))
+            fileouts.append(fileout)
         except:
             print(key1, 'not available')
+
+    plot_rgb_layers(lon2, lat2, tmp2i, layers, figsize = (10, 5), geometry=geometry, \
+                    render_profiles=render_profiles)
+
+    #tag the plots, so the same granule and parameters are not plotted again
+    files = [os.path.relpath(file2, plot_path2) for fileout in fileouts \
+             for _, file2 in render_fileouts(fileout, render_profiles) if os.path.isfile(file2)]
+    plot_cache_put(plot_path2, plot_fingerprint(file1, params), info, files)
+
+    if granule is not file1:
+        granule.close()
+    memory_report(timestamp3)
         
     #timestamp3, boundingbox, center
     return info
@@ -357,34 +483,67 @@ def reset_lon(i, tmp2, lon2):
     return tmp2t
 
             
-def plot_rgb(lon2, lat2, tmp2, tmp3, flag_dolp=False, figsize = (10, 5), \
-            vmin1=0, vmax1=1.0, cmap='YlOrRd', title=None, fileout=None, \
-             cbar_label=None, cbar_label_fontsize=14):
-    """
-    extent: for the map
-    vmin1, vmax1: color bar range
-    cmap: color style
+def plot_rgb_base(lon2, lat2, tmp2, flag_dolp=False, figsize = (10, 5), geometry=None):
     """
+    Base map of a granule: rgb (or dolp) background, coastlines, ocean/land and gridlines.
+    Shared by all the variables plotted over it, see plot_rgb_layers.
 
-    extent, proj, flag_crossdateline = plot_crossdateline_extent(lon2, lat2)
+    geometry: SwathGeometry of lon2/lat2, computed here if None
+    """
+    if geometry is None:
+        geometry = SwathGeometry(lon2, lat2)
+    extent, proj = geometry.extent, geometry.projection
 
     fig = plt.figure(figsize=figsize)
-    ax = plt.axes(projection=proj)
-    ax.set_extent(extent, crs=ccrs.PlateCarree())
+    try:
+        ax = plt.axes(projection=proj)
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+    
+        ################################
+        ### plot rgb ###################
+        if(not flag_dolp):
+            tmp2 = reset_data_for_rgb(tmp2)
+        else:
+            tmp2 = reset_data_for_rgb(tmp2, scale1=2, scale2=0.5, bias=0)
+
+        plot_crossdateline_rgb(ax, lon2, lat2, tmp2, geometry=geometry)
+        #plt.pcolormesh(lon2, lat2, tmp2,transform=ccrs.PlateCarree())
+
+        ########################
+        xbin=5
+        ybin=5
+        alpha=0.3
+    
+        #zorder: ocean/land -1, rgb and variables 1, coastlines 1.5, gridlines 2,
+        #so variables added later are still drawn between the rgb and the coastlines
+        gl=ax.gridlines(linewidth=0.5, color='gray', alpha=0.3, linestyle='-')
+        cl=ax.coastlines(resolution='50m', color='k', linewidth=0.1) #10m, 110m
+        ax.add_feature(cartopy.feature.OCEAN, edgecolor='w',linewidth=0.01)
+        ax.add_feature(cartopy.feature.LAND, edgecolor='w',linewidth=0.01)
+        gl.top_labels = False #True
+        gl.bottom_labels = True
+        gl.left_labels = True
+        gl.right_labels = False
+        gl.xlocator = mticker.FixedLocator(np.arange(-180,180,xbin))
+        gl.ylocator = mticker.FixedLocator(np.arange(-90,90,ybin))
+        gl.xformatter = LONGITUDE_FORMATTER
+        gl.yformatter = LATITUDE_FORMATTER
+        ax.set_xlabel(r"Longitude($^\circ$)")
+        ax.set_ylabel(r"Latitude($^\circ$)")
+    except Exception:
+        #the caller never gets the figure, close it here (worker processes)
+        plt.close(fig)
+        raise
+    return fig, ax
+
+def add_scalar_layer(ax, lon2, lat2, tmp3, vmin1=0, vmax1=1.0, cmap='YlOrRd', \
+                     cbar_label=None, cbar_label_fontsize=14, geometry=None):
+    """
+    Plot one variable with its colorbar over the base map, returns the new artists for remove_layer
+    """
+    collections = list(ax.collections)
+    meshes = []
     
-    ################################
-    ### plot rgb ###################
-    if(not flag_dolp):
-        tmp2 = reset_data_for_rgb(tmp2)
-    else:
-        tmp2 = reset_data_for_rgb(tmp2, scale1=2, scale2=0.5, bias=0)
-
-    plot_crossdateline_rgb(ax, lon2, lat2, tmp2)
-    #plt.pcolormesh(lon2, lat2, tmp2,transform=ccrs.PlateCarree())
-
-    ################################
-    #### plot variable #############
-
     # Determine if longitudes cross the dateline
     #fixed cross dateline issue: from Kehrli, Matthew
     #flag_crossdateline = (ds['longitude'].max() - ds['longitude'].min()) > 180    
@@ -400,74 +559,89 @@ def plot_rgb(lon2, lat2, tmp2, tmp3, flag_dolp=False, figsize = (10, 5), \
 
         plot_crossdateline_scalar(ax, lon2, lat2, tmp3, cmap=cmap, levels=levels,\
                                ticks=ticks, tick_labels=tick_labels, \
-                               cbar_label=cbar_label, cbar_label_fontsize=cbar_label_fontsize)
+                               cbar_label=cbar_label, cbar_label_fontsize=cbar_label_fontsize, geometry=geometry)
     except:
         pass
-    
-    ########################
-    xbin=5
-    ybin=5
-    alpha=0.3
-    
-    gl=ax.gridlines(linewidth=0.5, color='gray', alpha=0.3, linestyle='-')
-    cl=ax.coastlines(resolution='50m', color='k', linewidth=0.1) #10m, 110m
-    ax.add_feature(cartopy.feature.OCEAN, edgecolor='w',linewidth=0.01)
-    ax.add_feature(cartopy.feature.LAND, edgecolor='w',linewidth=0.01)
-    gl.top_labels = False #True
-    gl.bottom_labels = True
-    gl.left_labels = True
-    gl.right_labels = False
-    gl.xlocator = mticker.FixedLocator(np.arange(-180,180,xbin))
-    gl.ylocator = mticker.FixedLocator(np.arange(-90,90,ybin))
-    gl.xformatter = LONGITUDE_FORMATTER
-    gl.yformatter = LATITUDE_FORMATTER
-    ax.set_xlabel(r"Longitude($^\circ$)")
-    ax.set_ylabel(r"Latitude($^\circ$)")
-    plt.tight_layout()
-    plt.title(title)
-
-    if(fileout):
-        plt.savefig(fileout, dpi=400, bbox_inches='tight', pad_inches=0.1)
-    #plt.show()
-
-def plot_crossdateline_extent(lon2, lat2):
+    finally:
+        meshes = [c for c in ax.collections if c not in collections]
+    return meshes
+
+def remove_layer(meshes):
+    """remove a variable and its colorbar, the base map is left as it was"""
+    for mesh in meshes:
+        if mesh.colorbar is not None:
+            mesh.colorbar.remove()
+        mesh.remove()
+            
+def plot_rgb(lon2, lat2, tmp2, tmp3, flag_dolp=False, figsize = (10, 5), \
+            vmin1=0, vmax1=1.0, cmap='YlOrRd', title=None, fileout=None, \
+             cbar_label=None, cbar_label_fontsize=14, geometry=None, \
+             render_profiles=("full",)):
     """
-    Compute map extent that handles dateline-crossing correctly.
-
-    Parameters
-    ----------
-    lon2, lat2 : 2D numpy arrays
-        Longitude and latitude grids.
-
-    Returns
-    -------
-    extent : list
-        [lon_min, lon_max, lat_min, lat_max]
-    projection : ccrs.Projection
-        Recommended Cartopy projection.
-    flag_crossdateline : bool
-        Whether data crosses the dateline.
+    extent: for the map
+    vmin1, vmax1: color bar range
+    cmap: color style
+    geometry: SwathGeometry of lon2/lat2, shared with the other plots of the granule
+    render_profiles: fileout is saved once per profile (dpi=400 for full), see RENDER_PROFILES
     """
-    lon_flat = lon2.flatten()  # More explicit than concatenate
-    lat_flat = lat2.flatten()
-    lon_min, lon_max = lon_flat.min(), lon_flat.max()
-    lat_min, lat_max = lat_flat.min(), lat_flat.max()
+    if geometry is None:
+        geometry = SwathGeometry(lon2, lat2)
 
-    flag_crossdateline = (lon_max - lon_min) > 180
+    fig, ax = plot_rgb_base(lon2, lat2, tmp2, flag_dolp=flag_dolp, figsize=figsize, \
+                            geometry=geometry)
 
-    if flag_crossdateline:
-        print("*************cross dateline detected")
-        # Convert longitudes to [-180, 180] range for proper extent calculation
-        lon_wrapped = np.where(lon_flat > 180, lon_flat - 360, lon_flat)
-        extent = [lon_wrapped.min(), lon_wrapped.max(), lat_min, lat_max]
-        projection = ccrs.PlateCarree(central_longitude=180)
-    else:
-        extent = [lon_min, lon_max, lat_min, lat_max]
-        projection = ccrs.PlateCarree()
+    try:
+        ################################
+        #### plot variable #############
+        add_scalar_layer(ax, lon2, lat2, tmp3, vmin1=vmin1, vmax1=vmax1, cmap=cmap, \
+                         cbar_label=cbar_label, cbar_label_fontsize=cbar_label_fontsize, \
+                         geometry=geometry)
+        plt.tight_layout()
+        plt.title(title)
+
+        if(fileout):
+            save_figure(fig, fileout, dpi=400, render_profiles=render_profiles)
+    finally:
+        #also when the plot or the save fails, the figures of a worker process are not kept open
+        if(fileout):
+            plt.close(fig)
+    #plt.show()
 
-    return extent, projection, flag_crossdateline
+def plot_rgb_layers(lon2, lat2, tmp2, layers, flag_dolp=False, figsize = (10, 5), cbar_label_fontsize=14, \
+                    geometry=None, render_profiles=("full",)):
+    """
+    Same images as plot_rgb for several variables over the same rgb, with the base map drawn once.
 
-def plot_crossdateline_rgb(ax, lon2, lat2, rgb_array):
+    layers: list of dict(tmp3, vmin1, vmax1, cmap, title, fileout, cbar_label),
+    tmp3=None gives the rgb image alone. Each layer is saved, then removed from the map.
+    """
+    if geometry is None:
+        geometry = SwathGeometry(lon2, lat2)
+    fig, ax = plot_rgb_base(lon2, lat2, tmp2, flag_dolp=flag_dolp, figsize=figsize, \
+                            geometry=geometry)
+    try:
+        #the layout (tight_layout) and title of one layer must not shift the next one
+        subplotpars = {key: getattr(fig.subplotpars, key) for key in ['left', 'right', 'bottom', 'top', 'wspace', 'hspace']}
+        for layer in layers:
+            meshes = []
+            try:
+                fig.subplots_adjust(**subplotpars)
+                ax.set_title("")
+                meshes = add_scalar_layer(ax, lon2, lat2, layer.get('tmp3'), vmin1=layer.get('vmin1', 0), \
+                                          vmax1=layer.get('vmax1', 1.0), cmap=layer.get('cmap', 'YlOrRd'), \
+                                          cbar_label=layer.get('cbar_label'), cbar_label_fontsize=cbar_label_fontsize, \
+                                          geometry=geometry)
+                plt.tight_layout()
+                plt.title(layer.get('title'))
+                save_figure(fig, layer['fileout'], dpi=400, render_profiles=render_profiles)
+            except Exception as e:
+                print(f"❌ Failed to plot {layer.get('fileout')}: {e}")
+            finally:
+                remove_layer(meshes)
+    finally:
+        plt.close(fig)
+
+def plot_crossdateline_rgb(ax, lon2, lat2, rgb_array, geometry=None):
     """
     Plot RGB(A) image data that may cross the dateline using Cartopy.
     Works even if longitude coordinates are not equally spaced.
@@ -480,21 +654,22 @@ def plot_crossdateline_rgb(ax, lon2, lat2, rgb_array):
         Longitude and latitude grids.
     rgb_array : 3D numpy array (ny, nx, 3 or 4)
         RGB(A) image to plot.
+    geometry : SwathGeometry, optional
+        Dateline masks of lon2/lat2, computed here if None.
     """
     if lon2.shape != lat2.shape:
         raise ValueError("lon2 and lat2 must have the same shape")
     if rgb_array.shape[:2] != lon2.shape:
         raise ValueError("RGB array first two dimensions must match lon2/lat2")
 
-    ny, nx = lon2.shape
-    lon1d = lon2[0, :]
-    crosses = (lon1d.max() - lon1d.min()) > 180
+    if geometry is None:
+        geometry = SwathGeometry(lon2, lat2)
 
-    if crosses:
+    if geometry.crosses:
         print("***** Dateline crossing detected (RGB, manual wrap) *****")
         
-        # --- Normalize longitudes into [-180, 180] range
-        lon2_wrapped = np.where(lon2 > 180, lon2 - 360, lon2)
+        # --- Longitudes in [-180, 180] range
+        lon2_wrapped = geometry.lon2_wrapped
         
         # --- Plot both halves of the data separately ---
         for i in range(2):
@@ -502,14 +677,9 @@ def plot_crossdateline_rgb(ax, lon2, lat2, rgb_array):
             rgb_part = rgb_array.copy()
             
             # Apply the same masking logic as in reset_lon (only to RGB data)
-            if i == 0:  # Western hemisphere (lon < 0)
-                # Mask out eastern hemisphere and extreme western edge
-                rgb_part[lon2_wrapped > 0] = np.nan
-                rgb_part[lon2_wrapped < -179] = np.nan
-            else:  # Eastern hemisphere (lon > 0)
-                # Mask out western hemisphere and extreme eastern edge
-                rgb_part[lon2_wrapped < 0] = np.nan
-                rgb_part[lon2_wrapped > 179] = np.nan
+            # i=0: western hemisphere, mask out eastern hemisphere and extreme western edge
+            # i=1: eastern hemisphere, mask out western hemisphere and extreme eastern edge
+            rgb_part[geometry.rgb_hidden[i]] = np.nan
             
             # Create masked array for RGB only (following your pattern)
             rgb_masked = np.ma.masked_where(np.isnan(rgb_part), rgb_part)
@@ -528,7 +698,7 @@ def plot_crossdateline_rgb(ax, lon2, lat2, rgb_array):
 
 def plot_crossdateline_scalar(ax, lon2, lat2, data, cmap='viridis', levels=None,
                               ticks=None, tick_labels=None,
-                              cbar_label=None, cbar_label_fontsize=None):
+                              cbar_label=None, cbar_label_fontsize=None, geometry=None):
     """
     Plot 2D scalar data (e.g., AOD, SST, etc.) that may cross the dateline using Cartopy.
     Works even if longitude coordinates are not equally spaced.
@@ -541,58 +711,36 @@ def plot_crossdateline_scalar(ax, lon2, lat2, data, cmap='viridis', levels=None,
         Longitude and latitude grids.
     data : 2D numpy array
         Data to plot.
+    geometry : SwathGeometry, optional
+        Dateline masks of lon2/lat2, computed here if None.
     """
     if lon2.shape != lat2.shape or lon2.shape != data.shape:
         raise ValueError("lon2, lat2, and data must have the same shape")
 
+    if geometry is None:
+        geometry = SwathGeometry(lon2, lat2)
+
     # Set color range
     if levels is not None:
         vmin1, vmax1 = levels[0], levels[-1]
     else:
         vmin1, vmax1 = np.nanmin(data), np.nanmax(data)
 
-    # Detect dateline crossing
-    lon1d = lon2[0, :]
-    crosses = (lon1d.max() - lon1d.min()) > 180
-
-    if crosses:
+    if geometry.crosses:
         print("***** Dateline crossing detected (scalar, manual wrap) *****")
 
-        # Normalize longitudes into [-180, 180]
-        lon2_wrapped = np.where(lon2 > 180, lon2 - 360, lon2)
-
-        # Split east/west sides
-        east_mask = lon2_wrapped >= 0
-        west_mask = lon2_wrapped < 0
-
-        lat_min, lat_max = np.nanmin(lat2), np.nanmax(lat2)
-
-        # Plot east side
-        if np.any(east_mask):
-            lon_east = np.where(east_mask, lon2_wrapped, np.nan)
-            lat_east = np.where(east_mask, lat2, np.nan)
-            data_east = np.where(east_mask, data, np.nan)
-            extent = [np.nanmin(lon_east), np.nanmax(lon_east), lat_min, lat_max]
-            mesh_east = ax.pcolormesh(
-                lon_east, lat_east, data_east,
+        # Plot east side, then west side, lon/lat are nan outside of the side
+        meshes = []
+        for side_mask, lon_side, lat_side in geometry.sides:
+            data_side = np.where(side_mask, data, np.nan)
+            meshes.append(ax.pcolormesh(
+                lon_side, lat_side, data_side,
                 transform=ccrs.PlateCarree(),
                 cmap=cmap, vmin=vmin1, vmax=vmax1, shading='auto'
-            )
-
-        # Plot west side
-        if np.any(west_mask):
-            lon_west = np.where(west_mask, lon2_wrapped, np.nan)
-            lat_west = np.where(west_mask, lat2, np.nan)
-            data_west = np.where(west_mask, data, np.nan)
-            extent = [np.nanmin(lon_west), np.nanmax(lon_west), lat_min, lat_max]
-            mesh_west = ax.pcolormesh(
-                lon_west, lat_west, data_west,
-                transform=ccrs.PlateCarree(),
-                cmap=cmap, vmin=vmin1, vmax=vmax1, shading='auto'
-            )
+            ))
 
         # Keep one handle for colorbar
-        mesh = mesh_east if np.any(east_mask) else mesh_west
+        mesh = meshes[0]
 
     else:
         # Normal case (no crossing)
@@ -604,6 +752,13 @@ def plot_crossdateline_scalar(ax, lon2, lat2, data, cmap='viridis', levels=None,
         mesh.set_clim(vmin1, vmax1)
 
     # Optional colorbar
+    add_colorbar(ax, mesh, ticks=ticks, tick_labels=tick_labels, \
+                 cbar_label=cbar_label, cbar_label_fontsize=cbar_label_fontsize)
+
+    return mesh
+
+def add_colorbar(ax, mesh, ticks=None, tick_labels=None, cbar_label=None, cbar_label_fontsize=None):
+    """colorbar of a variable, only when ticks are given"""
     if ticks is not None:
         cbar = plt.colorbar(mesh, ax=ax, shrink=0.8, pad=0.02)
         cbar.set_ticks(ticks)
@@ -613,9 +768,6 @@ def plot_crossdateline_scalar(ax, lon2, lat2, data, cmap='viridis', levels=None,
             cbar.ax.xaxis.set_label_position('top')
             cbar.ax.set_xlabel(cbar_label, labelpad=10, fontsize=cbar_label_fontsize)
 
-    return mesh
-
-
 def plot_crossdateline_data(ax, lon2, lat2, tmp3, cmap='viridis', levels=None, \
                             ticks=None, tick_labels=None, cbar_label=None, cbar_label_fontsize=None):
     """
@@ -723,7 +875,7 @@ def plot_crossdateline_boundingbox(ax, lons, lats, timestamp1=None,
         lon1, lat1 = np.min(lons), np.min(lats)-1
         add_bounding_box_text(ax, lon1, lat1, timestamp1=timestamp1, transform1=transform1)
 
-def plot_bounding_box_one(lat, lon, timestamp1, xbin=15, ybin=15, title=None, fileout=None):
+def plot_bounding_box_one(lat, lon, timestamp1, xbin=15, ybin=15, title=None, fileout=None, render_profiles=("full",)):
     """
     Plot a bounding box on a global map with a text annotation displaying the timestamp.
     """
@@ -740,69 +892,77 @@ def plot_bounding_box_one(lat, lon, timestamp1, xbin=15, ybin=15, title=None, fi
     # Step 3: Set up the Orthographic projection centered on the bounding box
     proj = ccrs.Orthographic(central_longitude=central_lon, central_latitude=central_lat)
     fig, ax = plt.subplots(figsize=(10, 5), subplot_kw={'projection': proj})
-    ax.set_global()
-    
-    # Add map features
-    ax.add_feature(cartopy.feature.OCEAN, edgecolor='w', linewidth=0.01)
-    ax.add_feature(cartopy.feature.LAND, edgecolor='w', linewidth=0.01)
-    ax.add_feature(cfeature.COASTLINE, linewidth=0.8)
-    
-    # Step 4: Plot the bounding box as a polygon
-    lons = [lon[0,0], lon[0,-1], lon[-1,-1], lon[-1,0], lon[0,0]]
-    lats = [lat[0,0], lat[0,-1], lat[-1,-1], lat[-1,0], lat[0,0]]
+    try:
+        ax.set_global()
+    
+        # Add map features
+        ax.add_feature(cartopy.feature.OCEAN, edgecolor='w', linewidth=0.01)
+        ax.add_feature(cartopy.feature.LAND, edgecolor='w', linewidth=0.01)
+        ax.add_feature(cfeature.COASTLINE, linewidth=0.8)
+    
+        # Step 4: Plot the bounding box as a polygon
+        lons = [lon[0,0], lon[0,-1], lon[-1,-1], lon[-1,0], lon[0,0]]
+        lats = [lat[0,0], lat[0,-1], lat[-1,-1], lat[-1,0], lat[0,0]]
+
+        boundingbox = [lats, lons]
+        print(f"boundingbox: lats: {lats}, lons: {lons}")
+    
+        plot_crossdateline_boundingbox(ax, lons, lats, timestamp1=timestamp1)
+    
+        # Add gridlines for reference
+        gridlines = ax.gridlines(draw_labels=True, dms=True, x_inline=False, y_inline=False)
+        gridlines.top_labels = False
+        gridlines.right_labels = False
+        gridlines.left_labels = False
+        gridlines.bottom_labels = False
+        gridlines.xlocator = mticker.FixedLocator(np.arange(-180, 180, xbin))
+        gridlines.ylocator = mticker.FixedLocator(np.arange(-90, 90, ybin))
+    
+        # Add title
+        if title:
+            plt.title(title, fontsize=14)
+
+        # Save to file if fileout is provided
+        if fileout:
+            fileouts = save_figure(fig, fileout, dpi=300, render_profiles=render_profiles)
+            print(f"✅ Plot saved to {', '.join(fileouts)}")
+    finally:
+        if fileout:
+            plt.close(fig)
 
-    boundingbox = [lats, lons]
-    print(f"boundingbox: lats: {lats}, lons: {lons}")
-    
-    plot_crossdateline_boundingbox(ax, lons, lats, timestamp1=timestamp1)
-    
-    # Add gridlines for reference
-    gridlines = ax.gridlines(draw_labels=True, dms=True, x_inline=False, y_inline=False)
-    gridlines.top_labels = False
-    gridlines.right_labels = False
-    gridlines.left_labels = False
-    gridlines.bottom_labels = False
-    gridlines.xlocator = mticker.FixedLocator(np.arange(-180, 180, xbin))
-    gridlines.ylocator = mticker.FixedLocator(np.arange(-90, 90, ybin))
-    
-    # Add title
-    if title:
-        plt.title(title, fontsize=14)
-
-    # Save to file if fileout is provided
-    if fileout:
-        plt.savefig(fileout, dpi=300, bbox_inches='tight', pad_inches=0.1)
-        print(f"✅ Plot saved to {fileout}")
-        
     return boundingbox, center
 
-def plot_bounding_box_many(infov, title=None, fileout=None):
+def plot_bounding_box_many(infov, title=None, fileout=None, render_profiles=("full",)):
     """
     Plot bounding boxes with text labels for timestamps on a global map.
     """
     fig = plt.figure(figsize=(12, 6))
-    ax = plt.axes(projection=ccrs.PlateCarree())
-    ax.set_global()
+    try:
+        ax = plt.axes(projection=ccrs.PlateCarree())
+        ax.set_global()
 
-    ax.add_feature(cartopy.feature.OCEAN, edgecolor='w', linewidth=0.01)
-    ax.add_feature(cartopy.feature.LAND, edgecolor='w', linewidth=0.01)
-    ax.gridlines(draw_labels=True, dms=True, x_inline=False, y_inline=False)
+        ax.add_feature(cartopy.feature.OCEAN, edgecolor='w', linewidth=0.01)
+        ax.add_feature(cartopy.feature.LAND, edgecolor='w', linewidth=0.01)
+        ax.gridlines(draw_labels=True, dms=True, x_inline=False, y_inline=False)
 
-    for info in infov:
-        try:
-            timestamp1 = info["timestamp"]
-            bbox_lats, bbox_lons = info["boundingbox"]
-            center_lat, center_lon = info["center"]
+        for info in infov:
+            try:
+                timestamp1 = info["timestamp"]
+                bbox_lats, bbox_lons = info["boundingbox"]
+                center_lat, center_lon = info["center"]
     
-            plot_crossdateline_boundingbox(ax, bbox_lons, bbox_lats, timestamp1=timestamp1)
+                plot_crossdateline_boundingbox(ax, bbox_lons, bbox_lats, timestamp1=timestamp1)
 
-        except Exception as e:
-            print("❌ Failed to generate bounding box:", info)
-            print("Error:", e)
+            except Exception as e:
+                print("❌ Failed to generate bounding box:", info)
+                print("Error:", e)
 
-    if title:
-        plt.title(title, fontsize=14)
+        if title:
+            plt.title(title, fontsize=14)
 
-    if fileout:
-        plt.savefig(fileout, dpi=300, bbox_inches="tight", pad_inches=0.1)
-        print(f"✅ Plot saved to {fileout}")
+        if fileout:
+            fileouts = save_figure(fig, fileout, dpi=300, render_profiles=render_profiles)
+            print(f"✅ Plot saved to {', '.join(fileouts)}")
+    finally:
+        if fileout:
+            plt.close(fig)
@@ -23,6 +23,8 @@ import numpy as np
 import xarray as xr
 
 import argparse
+import matplotlib
+matplotlib.use("Agg")  #batch runs only write files, no display
 import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 from pathlib import Path
@@ -42,6 +44,7 @@ from tools.orca_utility import *
 from tools.orca_download import *
 from tools.orca_ai import *
 from tools.orca_pace import *
+from tools.orca_cache import evict_granule_cache, load_ledger, update_ledger, ledger_done
 
 from matplotlib import rcParams
 
@@ -73,6 +76,36 @@ parser.add_argument("--no_cloud", action="store_true",
                        help="Do NOT use Earthdata cloud (default: use cloud)")
 parser.add_argument("--plot_filter", action="store_true",
                        help="default plot everything, when specified plot filtered values")
+parser.add_argument("--nworkers", type=int, default=4,
+                       help="number of concurrent downloads, web files or earthaccess granules (default: 4)")
+parser.add_argument("--cache_path", type=str, default=os.environ.get('MAPOLTOOL_CACHE_PATH'),
+                       help="granule cache shared across runs (default: $MAPOLTOOL_CACHE_PATH, no cache if unset)")
+parser.add_argument("--nprefetch", type=int, default=2,
+                       help="number of L1C files downloaded ahead of plotting, 0 to download right before each plot")
+parser.add_argument("--incremental", action="store_true",
+                       help="only process granules absent from the processed-granule ledger, rebuild the html from the ledger")
+parser.add_argument("--cache_max_gb", type=float, default=200,
+                       help="size limit of the granule cache, least recently used granules are evicted")
+parser.add_argument("--nworkers_plot", type=int, default=int(os.environ.get('SLURM_CPUS_PER_TASK', 1)),
+                       help="number of processes plotting granules in parallel (default: $SLURM_CPUS_PER_TASK or 1)")
+parser.add_argument("--index_path", type=str, default=os.environ.get('MAPOLTOOL_INDEX_PATH'),
+                       help="granule summary index (sqlite) used by the selection (default: $MAPOLTOOL_INDEX_PATH, no index if unset)")
+parser.add_argument("--full_resolution", action="store_true",
+                       help="also save the full resolution png of each plot (full/ subfolder), the html only uses the previews")
+parser.add_argument("--replot", action="store_true",
+                       help="plot all granules again, even those already plotted from the same file with the same parameters")
+parser.add_argument("--nworkers_ai", type=int, default=AI_NWORKERS,
+                       help=f"number of concurrent ChatGSFC requests (default: {AI_NWORKERS})")
+parser.add_argument("--ai_rate", type=float, default=AI_RATE,
+                       help="ChatGSFC requests per second, e.g. the quota of the endpoint (default: no limit, only --nworkers_ai at once)")
+parser.add_argument("--ai_batch_size", type=int, default=1,
+                       help="granules per ChatGSFC request, both summaries in one json answer (default: 1, one request per summary)")
+parser.add_argument("--ai_max_tokens", type=int, default=None,
+                       help="ChatGSFC token budget of the run, the structured summaries are dropped first when it runs low; "
+                            "the requests in flight reserve an estimate of their tokens, so the run can exceed it by that error")
+parser.add_argument("--ai_max_seconds", type=float, default=None,
+                       help="ChatGSFC time budget of the run (seconds), as --ai_max_tokens; no request starts after it, "
+                            "those in flight still finish")
 
 args = parser.parse_args()
 
@@ -125,63 +158,21 @@ print("product=", product)
 #load correct information for that product
 outputfile_header, product_info_nrt, product_info_refined = get_pace_data_info(product)
 
-if(product=='harp2_fastmapol'):
-    outputfile_header='harp2_fastmapol_'
-    
-    dict1 = {'aod_min':[0.3,aod_min_default], \
-         'aod_min_plot':[0.3, aod_min_plot_default],\
-          'npixel_min':[100*40, npixel_min_default]}
-    
-    #100*100 early version
-    #100*20 may be too less
-        
-    iv=[40, 5, 85] #nadir rgb
-    iwvv=0
-    ivp=iv
-    iwvvp=iwvv
-    
-    iwv550=1 #550 for aod_min
-    iwv_aod=1 # for aod plot
-    iwv_rrs=0 # for rrs plot
-    criteria = (30, 30, 2.0)
-    nv_max = 90
-elif(product=='spexone_fastmapol'):
-    outputfile_header='spexone_fastmapol_'
-
-    dict1 = {'aod_min':[0.2,aod_min_default], \
-         'aod_min_plot':[0.2, aod_min_plot_default],\
-          'npixel_min':[100*4, npixel_min_default]}
-    
-    iwvv=[290, 170, 60] #l1c
-    iv=2 #0 degree
-    iwvvp=[39, 25, 9] #668.4302, 548.3369, 437.2723, 
-    ivp=iv
-    
-    iwv550=21 #550
-    iwv_aod=21 #550
-    iwv_rrs=5 #440
-    criteria = (140, 140, 2.0)
-    nv_max = 170
-elif(product=='spexone_remotap'):
-    outputfile_header='spexone_remotap_'
-    dict1 = {'aod_min':[0.2,aod_min_default], \
-         'aod_min_plot':[0.2, aod_min_plot_default],\
-          'npixel_min':[100*4, npixel_min_default]}
-
-    iwvv=[290, 170, 60] #l1c
-    iv=2 #0 degree
-    iwvvp=[39, 25, 9]
-    ivp=iv
-    
-    iwv550=7 #550
-    iwv_aod=7 #550
-    iwv_rrs=3 #440
-    criteria = (None, None, 5.0)
-    nv_max = 170
+settings = get_product_settings(product)
+outputfile_header = settings['outputfile_header']
+dict1 = {'aod_min':[settings['aod_min'], aod_min_default], \
+         'aod_min_plot':[settings['aod_min_plot'], aod_min_plot_default],\
+         'npixel_min':[settings['npixel_min'], npixel_min_default]}
+iv, iwvv, ivp, iwvvp = settings['iv'], settings['iwvv'], settings['ivp'], settings['iwvvp']
+iwv550, iwv_aod, iwv_rrs = settings['iwv550'], settings['iwv_aod'], settings['iwv_rrs']
+criteria = settings['criteria']
+nv_max = settings['nv_max']
 
 print("dict1:", dict1)
 aod_min, aod_min_plot, npixel_min = set_default_values(dict1)
 print("aod_min, aod_min_plot, npixel_min", aod_min, aod_min_plot, npixel_min)
+#thresholds of the granules in the ledger, granules processed with other values go through selection again
+selection = {'aod_min': aod_min, 'aod_min_plot': aod_min_plot, 'npixel_min': npixel_min, 'criteria': criteria}
 
 ####DO NOT SHARE the KEYS###########
 appkey = open(os.path.join(key_path,'earthdata_appkey.txt')).read().strip()
@@ -191,6 +182,16 @@ flag_rm = not args.no_rm  # True by default, False if --no_rm is specified
 flag_earthdata_cloud = not args.no_cloud  # True by default, False if --no_cloud is specified
 flag_plot_filter = args.plot_filter
 print("flag_plot_filter:", flag_plot_filter)
+nworkers = args.nworkers
+cache_path = args.cache_path
+print("cache_path:", cache_path)
+flag_incremental = args.incremental
+print("flag_incremental:", flag_incremental)
+#the html shows the previews, full resolution plots only on request
+render_profiles = ("preview", "full") if args.full_resolution else ("preview",)
+print("render_profiles:", render_profiles)
+index_path = args.index_path
+print("index_path:", index_path)
 
 if(flag_earthdata_cloud):
     auth = earthaccess.login(persist=True)
@@ -203,6 +204,7 @@ if timestamp:
 else:
     day1 = tspan[0]+'_'+tspan[1]
 
+flag_done = False
 try:
     #refined
     print("search refined data")
@@ -215,15 +217,23 @@ try:
     filelist_name=sensor+'_'+suite2+'_'+day1+'_filelist.txt'
 
     data_path, l1c_path, plot_path, html_path = setup_data(tspan, sensor=sensor, suite=suite2)
+    #processed-granule ledger of this product, next to the html folder
+    ledger_file = os.path.join(os.path.dirname(os.path.normpath(html_path)), 'ledger', sensor+'_'+suite2+'.json')
+    ledger = load_ledger(ledger_file)
+    skip_timestamps = ledger_done(ledger, selection) if flag_incremental else None
+    #in incremental mode, refined granules of this day may all be in the ledger already
+    flag_done = flag_incremental and any(ledger[timestamp1].get('plot_path')==plot_path for timestamp1 in skip_timestamps)
     if(flag_earthdata_cloud):
-        filelist_l2 = download_l2_cloud(tspan, short_name=short_name, output_folder=data_path)
+        filelist_l2 = download_l2_cloud(tspan, short_name=short_name, output_folder=data_path, \
+                                            cache_path=cache_path, nworkers=nworkers, skip_timestamps=skip_timestamps)
     else:
         filelist_l2 = download_l2_web(tspan_web, appkey, output_folder=data_path,  \
-                                      sensor_id=sensor_id, dtid=dtid, filelist_name=filelist_name)
+                                      sensor_id=sensor_id, dtid=dtid, filelist_name=filelist_name, nworkers=nworkers, \
+                                      cache_path=cache_path, skip_timestamps=skip_timestamps)
 except:
     print("didn't find in refined data")
 
-if(len(filelist_l2)==0):
+if(len(filelist_l2)==0 and not flag_done):
     try:
         #nrt
         print("search NRT data")
@@ -235,11 +245,16 @@ if(len(filelist_l2)==0):
         suite2 = product_info_nrt["suite2"]
         filelist_name=sensor+'_'+suite2+'_'+day1+'_filelist.txt'
         data_path, l1c_path, plot_path, html_path = setup_data(tspan, sensor=sensor, suite=suite2)
+        ledger_file = os.path.join(os.path.dirname(os.path.normpath(html_path)), 'ledger', sensor+'_'+suite2+'.json')
+        ledger = load_ledger(ledger_file)
+        skip_timestamps = ledger_done(ledger, selection) if flag_incremental else None
         if(flag_earthdata_cloud):
-            filelist_l2 = download_l2_cloud(tspan, short_name=short_name, output_folder=data_path)
+            filelist_l2 = download_l2_cloud(tspan, short_name=short_name, output_folder=data_path, \
+                                            cache_path=cache_path, nworkers=nworkers, skip_timestamps=skip_timestamps)
         else:
             filelist_l2 = download_l2_web(tspan_web, appkey, output_folder=data_path,\
-                                         sensor_id=sensor_id, dtid=dtid, filelist_name=filelist_name)
+                                         sensor_id=sensor_id, dtid=dtid, filelist_name=filelist_name, nworkers=nworkers, \
+                                         cache_path=cache_path, skip_timestamps=skip_timestamps)
     except:
         print("didn't find in nrt data neither, quit")
         sys.exit(1)
@@ -259,6 +274,8 @@ else:
 try:
     print("check existing folder")
     filelist_l2 = glob.glob(data_path+'/*.nc')
+    if flag_incremental:
+        filelist_l2 = [file1 for file1 in filelist_l2 if extract_timestamp(file1) not in skip_timestamps]
     nfile = len(filelist_l2)
     print("total file before selection in existing folder", nfile)
 except:
@@ -267,35 +284,12 @@ except:
 
 filev2 = select_data(filelist_l2, \
                      aod_min=aod_min, npixel_min=npixel_min, \
-                     iwv550=iwv550, criteria=criteria)
+                     iwv550=iwv550, criteria=criteria, index_path=index_path)
 nfile = len(filev2)
 print("total file after selection", nfile)
 
 
-key1v = ['aot', 'ssa', 'fvf', 'sph']
-vmin1v = [0, 0.7, 0, 0]
-vmax1v = [1, 1, 1, 1]
-cmap1v = ['YlOrRd', 'jet', 'jet', 'jet']
-
-key1v = ['aot', 'ssa', 'fvf', 'sph', 'chi2', 'nv_ref', 'nv_dolp']
-vmin1v = [0, 0.7, 0, 0, 0, 0, 0]
-vmax1v = [0.5, 1, 1, 1, 5, 170, 170]
-cmap1v = ['YlOrRd', 'jet', 'jet', 'jet', 'jet', 'jet', 'jet']
-
-dict1v= {'aot':[[0, 1],'YlOrRd','linear'] , \
-         'ssa':[[0.7, 1], 'jet','linear'], 'fvf':[[0, 1], 'jet','linear'], 'sph':[[0,1], 'jet','linear'], \
-         'aot_fine':[[0,1], 'YlOrRd','linear'], 'aot_coarse':[[0,1], 'YlOrRd','linear'], 'angstrom_440_670':[[-1,2], 'jet','linear'], \
-         'alh':[[0,6], 'jet','linear'], 'mr':[[1.3,1.65], 'jet','linear'], 'mi':[[0,0.03], 'jet','linear'], \
-          'wind_speed': [[0, 10], 'jet','linear'], 'chla':[[-2,1], 'jet','log10'],\
-          'Rrs2_mean':[[0,0.02], 'jet','linear'], 'Rrs2_std':[[0,0.02], 'jet','linear'],\
-          'chi2':[[0,5], 'jet','linear'], 'nv_ref':[[0,nv_max], 'jet','linear'], \
-          'nv_dolp':[[0,nv_max], 'jet','linear'],'quality_flag':[[0,5], 'jet','linear']}
-
-key1v = list(dict1v.keys())
-vmin1v = [dict1v[key][0][0] for key in key1v]
-vmax1v = [dict1v[key][0][1] for key in key1v]
-cmap1v = [dict1v[key][1] for key in key1v]
-scale1v = [dict1v[key][2] for key in key1v]
+key1v, vmin1v, vmax1v, cmap1v, scale1v = get_variable_settings(nv_max)
 
 print("key1v =", key1v)
 print("vmin1v =", vmin1v)
@@ -320,24 +314,76 @@ infov, infov_dict = make_plot(filev2, plot_path, l1c_path, \
                               iwvv=iwvv,iv=iv, iwvvp=iwvvp,ivp=ivp,\
                               iwv_aod=iwv_aod, iwv_rrs=iwv_rrs, \
                               key1v=key1v, vmin1v=vmin1v, vmax1v=vmax1v, cmap1v=cmap1v, scale1v=scale1v,\
-                             flag_plot_filter=flag_plot_filter)
+                             flag_plot_filter=flag_plot_filter, cache_path=cache_path, \
+                              nprefetch=args.nprefetch, flag_rm_l1c=flag_rm, nworkers=args.nworkers_plot, \
+                              render_profiles=render_profiles, flag_replot=args.replot)
 
 print(infov_dict)
 
+#in incremental mode, the granules of earlier runs without AI summaries (over budget, failed requests)
+#are asked again, the summaries already answered are read from the AI cache
+infov_retry = {}
+if flag_incremental:
+    ledger = load_ledger(ledger_file)
+    infov_retry = {timestamp1: ledger[timestamp1]["info"] for timestamp1 in sorted(ledger_done(ledger, selection)) \
+                   if ledger[timestamp1]["status"]=="selected" and ledger[timestamp1]["plot_path"]==plot_path \
+                   and timestamp1 not in infov_dict \
+                   and (ai_message_failed(ledger[timestamp1].get("message1")) or \
+                        ai_message_failed(ledger[timestamp1].get("message2")))}
+    print("granules of earlier runs asked again:", len(infov_retry))
+
 base_url="https://llm-api-access.caio.mcp.nasa.gov"
-message1v, message2v = ask_ai_all(infov_dict, api_key, base_url)
+ai_usage = AIUsage(max_tokens=args.ai_max_tokens, max_seconds=args.ai_max_seconds)
+message1v, message2v = ask_ai_all({**infov_dict, **infov_retry}, api_key, base_url, nworkers=args.nworkers_ai, rate=args.ai_rate, \
+                                  cache_path=cache_path, batch_size=args.ai_batch_size, usage=ai_usage)
+#tokens, time and errors of the AI requests, next to the ledger, to size the ChatGSFC quota,
+#one file per run, the hourly runs of a day do not overwrite each other
+run_time = datetime.fromtimestamp(ai_usage.time_start).strftime('%Y%m%dT%H%M%S')
+ai_usage.report(os.path.join(os.path.dirname(os.path.normpath(html_path)), 'ai_usage', \
+                             outputfile_header+day1+'_run'+run_time+'.json'))
 print(message1v)
 
+#record every granule gone through selection, with the artifacts of the selected ones
+ledger_entries = {extract_timestamp(file1): {"status": "rejected", "file": os.path.basename(file1), \
+                                             "plot_path": plot_path, "selection": selection} for file1 in filelist_l2}
+for timestamp1, info in infov_dict.items():
+    ledger_entries[timestamp1] = {"status": "selected", "file": ledger_entries.get(timestamp1, {}).get("file"), \
+                                  "plot_path": plot_path, "selection": selection, "info": info, \
+                                  "message1": message1v.get(timestamp1), "message2": message2v.get(timestamp1)}
+if infov_retry:
+    ledger = load_ledger(ledger_file)
+    for timestamp1 in infov_retry:
+        ledger_entries[timestamp1] = dict(ledger[timestamp1], message1=message1v.get(timestamp1), \
+                                          message2=message2v.get(timestamp1))
+update_ledger(ledger_file, ledger_entries)
+
+if flag_incremental:
+    #rebuild the page of this day from all granules processed so far (plots stay in plot_path)
+    ledger = load_ledger(ledger_file)
+    done = ledger_done(ledger, selection)
+    infov_dict = {timestamp1: entry["info"] for timestamp1, entry in sorted(ledger.items()) \
+                  if entry["status"]=="selected" and entry["plot_path"]==plot_path and timestamp1 in done}
+    infov = list(infov_dict.values())
+    message1v = {timestamp1: ledger[timestamp1]["message1"] for timestamp1 in infov_dict}
+    message2v = {timestamp1: ledger[timestamp1]["message2"] for timestamp1 in infov_dict}
+    nfile = len(infov_dict)
+    print("total file for the day, including earlier runs:", nfile)
+
 #text_box = message2v
 text_box = None
 
 
 title1 = day1
 global_map1= os.path.join(plot_path,sensor+'_'+suite2+'_'+day1+'_boxes.png')
-plot_bounding_box_many(infov, title=title1, fileout=global_map1)
+plot_bounding_box_many(infov, title=title1, fileout=global_map1, render_profiles=render_profiles)
+#file of the first (html) profile
+global_map1 = render_fileouts(global_map1, render_profiles)[0][1]
 
 #output_file = html_path+sensor+'_'+suite2+'_'+day1+'_n'+str(nfile)+"_aodmin"+str(aod_min)+"_chat5.html"
 output_file = os.path.join(html_path,outputfile_header+day1+'_n'+str(nfile)+"_aod"+str(aod_min)+"_chat5.html")
+if flag_incremental:
+    #the page of the day is rebuilt by every run, one name per day so the hourly runs replace it
+    output_file = os.path.join(html_path,outputfile_header+day1+"_aod"+str(aod_min)+"_chat5.html")
 
 sequence = [['globe', 'rgb', 'aot', ], ['ssa', 'fvf', 'sph']]
 titlev_custom = [["", "", "AOD (550nm)"], ["Single Scattering Albedo (550nm)", 
@@ -369,7 +415,8 @@ titlev_custom = [["", "Reflectance", "DoLP"], \
 title = format_simple_title(sensor, suite2, tspan)
 title2 = format_html_info(nfile, criteria, npixel_min, aod_min, aod_min_plot, flag_plot_filter=flag_plot_filter)
 
-image_groups = get_images_from_subfolders(plot_path)
+#plot_path/full holds the full resolution global map, not a granule
+image_groups = get_images_from_subfolders(plot_path, exclude=RENDER_PROFILES)
 #title2_html=title2_html
 hide_after_key = 'fvf'
 
@@ -383,7 +430,7 @@ else:
     
 create_html_from_subfolders(image_groups, output_file, sequence, global_map=global_map1, \
                             title=title, title2=title2,
-                            titlev=titlev_custom, resolution_factor=2, quality=75, \
+                            titlev=titlev_custom, resolution_factor=1, quality=75, \
                             sensor=sensor, suite=suite2,\
                             message1v=message1v, message2v=message2v, \
                             hide_after_key = hide_after_key,
@@ -403,10 +450,10 @@ except:
     print("failed copy the html file")
 
 
-l2_path, l2_file = os.path.split(filelist_l2[0])
+l2_path = data_path
 
     
-print("l2_path, l2_file:", l2_path, l2_file)
+print("l2_path:", l2_path)
 
 if(flag_rm):
     pathv = [l1c_path, l2_path]
@@ -416,3 +463,9 @@ if(flag_rm):
             print(f"✅ Folder removed: {path1}")
         except:
             print("do not exist", path1)
+
+#attempts, failures and time of every download call
+print("download summary:", retry_policy.summary())
+
+#keep the shared granule cache within its size limit
+evict_granule_cache(cache_path, max_size_gb=args.cache_max_gb)
@@ -0,0 +1,127 @@
+"""
+Statistics of the L2 variables of a granule over the pixels of the event (filter1)
+
+All variables are gathered on the filtered pixels (filter1 applied once), stacked and sorted,
+then mean, std, count, min/max, percentiles and histograms are computed for all of them together.
+No matplotlib: plot_l1c_l2 fills info from it, and it can be used without plotting.
+"""
+
+import numpy as np
+
+from tools.orca_data import as_l2_granule
+
+PERCENTILES = (5, 25, 50, 75, 95)
+NBIN = 50
+
+def granule_variable(granule, key1, iwv_aod=1, iwv_rrs=0, scale1='linear'):
+    """
+    values of key1 as plotted: rrs at iwv_rrs, other variables at iwv_aod (or as is without
+    wavelength dimension), in log10 if scale1='log10'
+    """
+    if('rrs' in key1.lower()):
+        iwv = iwv_rrs
+    else:
+        iwv = iwv_aod
+    try:
+        data = granule.get(key1, iwv)
+    except Exception:
+        #no wavelength dimension
+        data = granule.get(key1)[:,:]
+    if(scale1=='log10'):
+        data = np.log10(data)
+    return data
+
+def granule_statistics(granule, key1v, filter1, iwv_aod=1, iwv_rrs=0, scale1v=None, ranges=None, \
+                       percentiles=PERCENTILES, nbin=NBIN):
+    """
+    Statistics of each variable of key1v over the pixels of filter1 (nan ignored)
+
+    scale1v: 'linear'/'log10' for each key, statistics are computed on the plotted values
+    ranges: [vmin, vmax] of the histogram of each key, min/max of the values if None
+
+    Returns:
+    -------
+    stats: {key1: {"mean", "std", "count", "min", "max", "q", "percentiles", "hist", "hist_range"}},
+    keys not in the granule are left out
+    """
+    scale1v = scale1v or ['linear']*len(key1v)
+    index = np.flatnonzero(filter1)
+
+    keys, rows, rangev = [], [], []
+    for i1, key1 in enumerate(key1v):
+        try:
+            data = granule_variable(granule, key1, iwv_aod=iwv_aod, iwv_rrs=iwv_rrs, scale1=scale1v[i1])
+        except Exception:
+            print(f"⚠️ {key1} not available for the statistics")
+            continue
+        if data.shape != filter1.shape:
+            print(f"⚠️ {key1} {data.shape} does not match the filter {filter1.shape}")
+            continue
+        keys.append(key1)
+        rows.append(data.reshape(-1)[index])
+        rangev.append(ranges[i1] if ranges is not None else [np.nan, np.nan])
+    if not keys:
+        return {}
+    if index.size == 0:
+        #no pixel passes the filter, one nan per key keeps the indexing below valid
+        rows = [np.full(1, np.nan) for row in rows]
+
+    #(nkey, npixel), each row sorted once: the nan go to the end, count values are valid
+    values = np.sort(np.stack(rows).astype(np.float64), axis=1)
+    count = (~np.isnan(values)).sum(axis=1)
+    valid = np.arange(values.shape[1])[None, :] < count[:, None]
+    values[~valid] = 0
+    ikey = np.arange(len(keys))
+    last = np.maximum(count-1, 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = values.sum(axis=1)/count
+        std = np.sqrt((np.where(valid, values-mean[:, None], 0)**2).sum(axis=1)/count)
+
+        #min, max and percentiles (linear interpolation, as np.nanpercentile) from the sorted rows
+        vmin = np.where(count > 0, values[ikey, 0], np.nan)
+        vmax = np.where(count > 0, values[ikey, last], np.nan)
+        pos = np.asarray(percentiles, dtype=np.float64)[:, None]/100*last[None, :]
+        i0 = np.floor(pos).astype(np.int64)
+        i1 = np.minimum(i0+1, last[None, :])
+        frac = pos - i0
+        q = values[ikey, i0] + (values[ikey, i1]-values[ikey, i0])*frac
+        q[:, count == 0] = np.nan
+
+    #histograms counted as np.histogram (last bin closed), by bisection of the sorted rows
+    hist = np.zeros((len(keys), nbin), dtype=np.int64)
+    lo, hi = np.zeros(len(keys)), np.zeros(len(keys))
+    for i in range(len(keys)):
+        lo[i], hi[i] = rangev[i]
+        if np.isnan(lo[i]):
+            lo[i] = vmin[i]
+        if np.isnan(hi[i]):
+            hi[i] = vmax[i]
+        if count[i] == 0:
+            continue
+        row = values[i, :count[i]]
+        nbelow = np.searchsorted(row, np.linspace(lo[i], hi[i], nbin+1), side='left')
+        nbelow[-1] = np.searchsorted(row, hi[i], side='right')
+        hist[i] = np.diff(nbelow)
+
+    stats = {}
+    for i, key1 in enumerate(keys):
+        stats[key1] = {"mean": mean[i], "std": std[i], "count": int(count[i]), "min": vmin[i], "max": vmax[i], \
+                       "q": list(percentiles), "percentiles": q[:, i].tolist(), \
+                       "hist": hist[i].tolist(), "hist_range": [lo[i], hi[i]]}
+    return stats
+
+def compute_statistics(file1, key1v, iwv_aod=1, iwv_rrs=0, scale1v=None, ranges=None, \
+                       aod_min=0.3, criteria=(30, 20, 2.0)):
+    """
+    granule_statistics of an L2 file (or L2Granule) over the pixels passing aod_min and criteria,
+    a path is opened and closed here
+    """
+    granule = as_l2_granule(file1)
+    try:
+        npixel_valid0, npixel_valid1, filter1 = granule.filter(iwv550=iwv_aod, aot_min=aod_min, criteria=criteria)
+        return granule_statistics(granule, key1v, filter1, iwv_aod=iwv_aod, iwv_rrs=iwv_rrs, \
+                                  scale1v=scale1v, ranges=ranges)
+    finally:
+        if granule is not file1:
+            granule.close()
@@ -6,26 +6,46 @@ Need specify proper directories
 Note that earthaccess download, use a defult folder of ./data
 """
 
-import earthaccess
-import requests
-
 import os
+import sys
 import glob
 import re
-import requests
 import subprocess
+try:
+    import resource
+except ImportError:
+    #not on windows, memory_report then gives no peak memory
+    resource = None
 import numpy as np
-import xarray as xr
-
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
 from pathlib import Path
-from matplotlib import rcParams
 
 #from tools.orca_html import *
 #from tools.orca_plot import *
 #from tools.orca_download import *
 
+def memory_report(label=""):
+    """
+    Print and return the current and peak memory (MB) of this process and the number of open figures,
+    called after each granule so a leak shows up as a growing rss/figure count.
+    Without /proc (macOS) rss is the peak, without resource (windows) both are None.
+    """
+    peak = None
+    if resource is not None:
+        #ru_maxrss is in KiB on linux, in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/(1e6 if sys.platform == "darwin" else 1e6/1024)
+    #the current rss is only in /proc (linux), otherwise the peak is reported
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1])*os.sysconf("SC_PAGE_SIZE")/1e6
+    except (OSError, ValueError, AttributeError):
+        rss = peak
+    #matplotlib is not imported here, headless runs (tools/orca_detect.py) have no figures
+    plt = sys.modules.get("matplotlib.pyplot")
+    nfig = len(plt.get_fignums()) if plt else 0
+    mb = lambda value: "n/a" if value is None else f"{value:.0f} MB"
+    print(f"🧠 Memory {label}: rss {mb(rss)}, peak {mb(peak)}, open figures {nfig}")
+    return {"rss": rss, "peak": peak, "figures": nfig}
+
 def set_default_values(dict1):
     """
     Handles user-provided value vs. default value.